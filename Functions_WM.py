@@ -1,17 +1,10 @@
 from psychopy import visual,core,sound
 import csv
 import numpy as np
+from tone_synthesis import to_stereo
 
 
 ####### FUNCTIONSSSSSSSSS #######################
-# Function to play a flash
-def play_flash(flash_duration):
-    flash_stim.setAutoDraw(True)
-    win.flip()
-    core.wait(flash_duration)
-    flash_stim.setAutoDraw(False)
-    win.flip()
-
 # Function to read the CSV file and return a list of dicts
 def load_stimuli_parameters(csv_filename):
     with open(csv_filename, mode='r') as infile:
@@ -30,6 +23,16 @@ def show_feedback(win, text):
 sample_rate = 44100
 duration = 0.5
 
+def create_mono_buffer(frequency):
+    """
+    Create a float32 mono buffer for a given frequency.
+    
+    :param frequency: Frequency of the tone.
+    :return: Mono signal buffer.
+    """
+    t = np.linspace(0, duration, int(sample_rate * duration), endpoint=False)
+    return np.sin(2 * np.pi * frequency * t).astype(np.float32)
+
 def create_stereo_buffer(frequency, left_amp=1.0, right_amp=0.5):
     """
     Create a stereo buffer for a given frequency with specified amplitudes for left and right channels.
@@ -39,10 +42,7 @@ def create_stereo_buffer(frequency, left_amp=1.0, right_amp=0.5):
     :param right_amp: Amplitude of the tone in the right channel.
     :return: Stereo signal buffer.
     """
-    t = np.linspace(0, duration, int(sample_rate * duration), endpoint=False)
-    mono_signal = np.sin(2 * np.pi * frequency * t)
-    stereo_signal = np.array([left_amp * mono_signal, right_amp * mono_signal])
-    return stereo_signal.T
+    return to_stereo(create_mono_buffer(frequency), left_amp, right_amp)
 
 def play_tone(frequency, left_amp=1.0, right_amp=0.5):
     """
@@ -2,15 +2,18 @@
 # adapted from Noah Markowtiz' TAMy task
 # Chase M 2024
 
-from psychopy import visual, core, event, data, gui, sound
+from psychopy import visual, core, event, sound
 import os
 import json
 import csv
 import numpy as np
 from utils import generate_tone_sequence
+from av_scheduler import flash_train, sound_event, run_timeline
 from datetime import datetime
-import serial
-port = serial.Serial("COM3",115200) # serial port and baud rate for dell xps laptop
+from reward_daemon import open_reward_port
+from session_plan import compile_session, save_plan, PlanHandler
+from launch import launch_settings
+port = open_reward_port("COM3",115200) # serial port and baud rate for dell xps laptop, shared through reward_daemon.py if it runs
 
 
 # Constants
@@ -23,10 +26,9 @@ cue_duration = 0.5  # Duration of each tone sequence
 inter_sequence_interval = inter_sequence_flashes * flash_period  # Interval between sequences
 
 
-# Set up experiment parameters via a GUI
+# Set up experiment parameters via a GUI, or without one from --participant/--profile
 info = {'Participant Name': ''}
-dlg = gui.DlgFromDict(dictionary=info, title='Experiment Setup')
-if dlg.OK == False:
+if not launch_settings(info, title='Experiment Setup'):
     core.quit()  # User pressed cancel
 
 # user gives us the name and a random seed
@@ -67,18 +69,11 @@ box_size = 200  # Static box size
 greenBox = visual.Rect(win, width=box_size, height=box_size, pos=(-300, 0), fillColor='green')
 redBox = visual.Rect(win, width=box_size, height=box_size, pos=(300, 0), fillColor='red')
 flash_stim = visual.Rect(win, size=(200, 200), pos=(0, 0), fillColor='white')
+frame_rate = win.getActualFrameRate() or 60  # measured once, used to lock the AV timeline to flips
 
 
 
 ####### FUNCTIONSSSSSSSSS #######################
-# Function to play a flash
-def play_flash(flash_duration):
-    flash_stim.setAutoDraw(True)
-    win.flip()
-    core.wait(flash_duration)
-    flash_stim.setAutoDraw(False)
-    win.flip()
-
 # Function to read the CSV file and return a list of dicts
 def load_stimuli_parameters(csv_filename):
     with open(csv_filename, mode='r') as infile:
@@ -105,8 +100,11 @@ stimuli_parameters = load_stimuli_parameters(csv_filename)
 
 
 
-# Set up the TrialHandler
-trials = data.TrialHandler(stimuli_parameters, nReps=100, method='random')
+# Compile the session plan
+plan = compile_session(stimuli_parameters, nReps=100, method='random', wm_delay=inter_sequence_interval,
+                       lead_in=pre_stim_flashes * flash_period)
+save_plan(plan, data_file_path)  # trial order of this session, next to the data file
+trials = PlanHandler(plan)
 
 
 # Create a mouse object
@@ -119,44 +117,30 @@ for trial in trials:
     # Move mouse off screen
     mouse.setPos(newPos=(win.size[0] * 1.5, win.size[1] * 1.5))
     
-    # Convert parameters to the correct type (all values read from CSV are strings)
-    cue_frequency = float(current_params['cue_frequency'])
-    cue_frequency_range = float(current_params['cue_frequency_range'])
-    choice_frequency = float(current_params['choice_frequency'])
-    choice_frequency_range = float(current_params['choice_frequency_range'])
-    coherence = float(current_params['coherence'])
+    # Typed parameters from the compiled session plan
+    cue_frequency = current_params['cue_frequency']
+    cue_frequency_range = current_params['cue_frequency_range']
+    choice_frequency = current_params['choice_frequency']
+    choice_frequency_range = current_params['choice_frequency_range']
+    coherence = current_params['coherence']
     # Determine the correct response
-    correct_response = 'same' if cue_frequency == choice_frequency else 'diff'
+    correct_response = current_params['correct_response']
     # Generate the cue and choice tone sequences
     cue_tone_sequence = generate_tone_sequence(coherence, cue_frequency, cue_frequency_range)
     choice_tone_sequence = generate_tone_sequence(coherence, choice_frequency, choice_frequency_range)
 
-    # present synchronized AV
-    
-    clock = core.Clock()
-    num_flashes = pre_stim_flashes + inter_sequence_flashes
-    total_flash_duration = num_flashes * flash_period
-    last_flash_time = 0
-    
-    # Initial pre-stimulus flashes
-    for i in range(pre_stim_flashes):
-        play_flash(flash_duration)
-        core.wait(flash_period - flash_duration)
-        
-    # cue sequence (stim 1)
+    # present synchronized AV, every onset locked to a screen flip
     cue_sound = sound.Sound(cue_tone_sequence, sampleRate=44100)
-    cue_sound.play()
-    core.wait(cue_sound.getDuration())
-    
-    # Inter-sequence flashes
-    for i in range(inter_sequence_flashes):
-        play_flash(flash_duration)
-        core.wait(flash_period - flash_duration)
-        
-    # Play the choice tone sequence (stim 2)
     choice_sound = sound.Sound(choice_tone_sequence, sampleRate=44100)
-    choice_sound.play()
-    core.wait(choice_sound.getDuration())
+    cue_onset = pre_stim_flashes * flash_period
+    choice_onset = cue_onset + cue_sound.getDuration() + inter_sequence_flashes * flash_period
+    timeline = flash_train(flash_stim, pre_stim_flashes, flash_period, flash_duration)
+    timeline.append(sound_event(cue_sound, cue_onset, label='cue'))
+    timeline += flash_train(flash_stim, inter_sequence_flashes, flash_period, flash_duration,
+                            start=cue_onset + cue_sound.getDuration())
+    timeline.append(sound_event(choice_sound, choice_onset, label='choice'))
+    av_report = run_timeline(win, timeline, frame_rate=frame_rate)
+    av_error = max(abs(ev['error_ms']) for ev in av_report)
 
     # Draw selection boxes
     greenBox.draw()
@@ -222,7 +206,8 @@ for trial in trials:
         'Cue Frequency Range': cue_frequency_range,
         'Choice Frequency': choice_frequency,
         'Choice Frequency Range': choice_frequency_range,
-        'Coherence': coherence
+        'Coherence': coherence,
+        'Max AV Error (ms)': av_error
     }
     trial_data_list.append(trial_data)
     
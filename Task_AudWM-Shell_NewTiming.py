@@ -3,18 +3,32 @@
 # June 2024
 # see github repo seemackey/Task_AudWM
 
-from psychopy import visual, core, event, data, gui, sound
+from psychopy import visual, core, event, sound
 import os
+import time
 from datetime import datetime
 import csv
 import numpy as np
 import random
-from Functions_WM import play_flash, load_stimuli_parameters, show_feedback
+from Functions_WM import load_stimuli_parameters, show_feedback
 import ctypes
 ctypes.windll.kernel32.SetThreadExecutionState(0x80000002) # prevent WINDOWS machine from sleeping
-import serial
+from reward_daemon import open_reward_port
 from utils import generate_tone_sequence
-port = serial.Serial("COM4",115200) # serial port and baud rate for dell xps laptop
+from adaptive import QuestPlusHandler
+from performance import PerformanceTracker
+from telemetry import TelemetryPublisher
+from frame_timing import FlipRecorder
+from event_journal import (EventJournal, SOUND_START, MOUSE_ENTER, ESCAPE_CHECK, REWARD, TIMEOUT,
+                           RESPONSE_PERIOD, TRIAL_END)
+from waiting import idle_wait, wait_for, CPUMeter
+from session_plan import compile_session, compile_trial, save_plan, load_plan, PlanHandler
+from launch import launch_settings
+from warmup import warm_up
+from profiling import PhaseProfiler
+from audio_process import AudioProcess
+from checkpoint import TrialLog, save_checkpoint, find_resumable, restore_random_state
+port = open_reward_port("COM4",115200) # serial port and baud rate for dell xps laptop, shared through reward_daemon.py if it runs
 
 # Constants
 
@@ -27,13 +41,17 @@ cue_duration = 0.5  # Duration of each tone sequence
 inter_sequence_interval = inter_sequence_flashes * flash_period  # Interval between sequences
 wm_delay = 0.3  # Delay between cue and choice sounds
 AltSpkrAmp = 1 # always one in the nonspatial task (this script)
+adaptive = False  # pick coherence with QUEST+ instead of cycling through the soundslist
+adaptive_coherences = np.round(np.linspace(0.5, 1.0, 11), 2)  # coherence levels QUEST+ can choose from
+adaptive_wm_delays = None  # WM delays (s) QUEST+ can choose from, e.g. [0.3, 1.0, 2.0]; None always uses wm_delay
+separate_audio = False  # play cue and choice from a separate audio process (audio_process.py) and log their onsets
 
-# Set up experiment parameters via a GUI
-info = {'Participant Name': ''}
-dlg = gui.DlgFromDict(dictionary=info, title='Experiment Setup')
-if not dlg.OK:
+# Set up experiment parameters via a GUI, or without one from --participant/--profile
+info = {'Participant Name': '', 'Resume': False}  # Resume (or --resume): continue the last session if it crashed
+if not launch_settings(info, title='Experiment Setup'):
     core.quit()  # User pressed cancel
 participant_name = info['Participant Name']
+resume = bool(info['Resume'])
 seed = 12345
 csv_filename = 'soundslist.csv'
 
@@ -47,6 +65,10 @@ if not os.path.exists(data_folder_path):
 timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
 data_file_name = f"{participant_name}_{timestamp}.csv"
 data_file_path = os.path.join(data_folder_path, data_file_name)
+checkpoint = find_resumable(data_folder_path, participant_name) if resume else None
+if checkpoint is not None:
+    data_file_path = checkpoint['data_file_path']
+    print(f"Resuming {data_file_path} at trial {checkpoint['next_trial']}")
 
 # Load monitor specifications
 monitor_specs = {"screen_resolution": [800, 480], "monitor_width": 800, "full_screen": True}
@@ -72,125 +94,191 @@ flash_stim = visual.Rect(win, size=(200, 200), pos=(0, 0), fillColor='white')
 yellowBox = visual.Rect(win, width=box_size, height=box_size, pos=(0, 0), fillColor='yellow')
 stimuli_parameters = load_stimuli_parameters(csv_filename)
 
+# Warm up audio, synthesis and window so their first-call costs do not land on trial 0
+startup = warm_up(win, stimuli=[greenBox, redBox, flash_stim, yellowBox],
+                  synthesis=lambda: generate_tone_sequence(0.5, 400, 0.5, sampleRate=44100, seed=seed))
+startup.save(data_file_path)
+print(startup.summary())
+if separate_audio:
+    audio = AudioProcess(samplingRate=44100)
+    audio.start()
+journal = EventJournal.for_session(data_file_path)  # in-trial events, next to the data file as <name>_events.bin
+flips = FlipRecorder(win, max_dropped=2, max_jitter=2.0, journal=journal)  # records every win.flip() from here on
+
 # trial setup
 try:
-    trials = data.TrialHandler(stimuli_parameters, nReps=400, method='random')
+    if checkpoint is not None:
+        # Continue the saved schedule where it stopped instead of drawing a new one
+        if adaptive:
+            trials = checkpoint['adaptive']
+        else:
+            trials = PlanHandler(load_plan(data_file_path), start=checkpoint['next_trial'])
+        restore_random_state(checkpoint)
+    elif adaptive:
+        trials = QuestPlusHandler(stimuli_parameters, nTrials=400, coherences=adaptive_coherences,
+                                  wm_delays=adaptive_wm_delays, seed=None)  # rows drawn afresh every session
+    else:
+        plan = compile_session(stimuli_parameters, nReps=400, method='random', wm_delay=wm_delay)
+        save_plan(plan, data_file_path)  # trial order of this session, next to the data file
+        trials = PlanHandler(plan)
 except Exception as e:
     print(f"Error in initializing TrialHandler: {e}")
     core.quit()
 # Create a mouse object
 mouse = event.Mouse(win=win)
 trial_data_list = []
+if checkpoint is not None:
+    performance = checkpoint['performance']
+    trial_log = TrialLog(data_file_path, checkpoint['fieldnames'], checkpoint['log_offset'])
+else:
+    performance = PerformanceTracker(windows=(10, 20, 50))  # running % correct, printed after each trial
+    trial_log = TrialLog(data_file_path)  # appends each trial to the CSV
+cpu_meter = CPUMeter()  # CPU use of the session, printed at the end
+telemetry = TelemetryPublisher()  # live events for telemetry.py, dropped if nobody is listening
+profiler = PhaseProfiler.from_environment(data_file_path)  # only on with AUDWM_PROFILING=1 or --profiling
+
+def escape_pressed():
+    """Check the keyboard for escape and journal the check"""
+    pressed = 'escape' in event.getKeys()
+    journal.log(ESCAPE_CHECK, pressed)
+    return pressed
 
 def save_data(trial_data_list, data_file_path):
-    """Save trial data to a CSV file."""
+    """Append the trials not yet saved to the CSV file."""
     try:
-        with open(data_file_path, "w", newline='') as f:
-            fieldnames = trial_data_list[0].keys()
-            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore', lineterminator='\n')
-            writer.writeheader()
-            writer.writerows(trial_data_list)
+        trial_log.sync(trial_data_list)
     except Exception as e:
         print(f"Failed to save data: {e}")
 
+def quit_session():
+    """End the session on escape: it was ended on purpose, so it is not offered for resume"""
+    save_data(trial_data_list, data_file_path)
+    save_checkpoint(data_file_path, trials.thisN, trial_log, finished=True)
+    win.close()
+    core.quit()
+
 # Main experiment loop
 try:
     for trial in trials:
-        current_params = trial
+        # QUEST+ picks coherence (and the WM delay) online, so its trials are compiled one at a time
+        current_params = compile_trial(trial, trial.get('wm_delay', wm_delay)) if adaptive else trial
+        flips.start_trial(trials.thisN)
+        journal.start_trial(trials.thisN)
         # Move mouse off screen
         mouse.setPos(newPos=(win.size[0] * 1.5, win.size[1] * 1.5))
         #mouse.setVisible(False)
-        # Convert parameters to the correct type (all values read from CSV are strings)
-        cue_frequency = float(current_params['cue_frequency'])
-        cue_frequency_range = float(current_params['cue_frequency_range'])
-        choice_frequency = float(current_params['choice_frequency'])
-        choice_frequency_range = float(current_params['choice_frequency_range'])
-        coherence = float(current_params['coherence'])
-        correct_response = 'same' if cue_frequency == choice_frequency else 'diff'
+        # Typed parameters from the compiled session plan
+        cue_frequency = current_params['cue_frequency']
+        cue_frequency_range = current_params['cue_frequency_range']
+        choice_frequency = current_params['choice_frequency']
+        choice_frequency_range = current_params['choice_frequency_range']
+        coherence = current_params['coherence']
+        correct_response = current_params['correct_response']
+        trial_wm_delay = current_params['wm_delay']
         # Generate the cue and choice tone sequences, returns numpy array
-        cue_tone_sequence = generate_tone_sequence(coherence, cue_frequency, cue_frequency_range,sampleRate = 44100,tone_duration = 0.025,sequence_duration = 0.5, seed = seed)
-        choice_tone_sequence = generate_tone_sequence(coherence, choice_frequency, choice_frequency_range,sampleRate = 44100,tone_duration = 0.025,sequence_duration = 0.5, seed = seed)
+        with profiler.phase('synthesis'):
+            cue_tone_sequence = generate_tone_sequence(coherence, cue_frequency, cue_frequency_range,sampleRate = 44100,tone_duration = 0.025,sequence_duration = 0.5, seed = seed)
+            choice_tone_sequence = generate_tone_sequence(coherence, choice_frequency, choice_frequency_range,sampleRate = 44100,tone_duration = 0.025,sequence_duration = 0.5, seed = seed)
 
         # cue sequence (stim 1), a numpy array we play as a sound
-        cue_sound = sound.Sound(cue_tone_sequence, sampleRate=44100)
-        cue_sound.play()
-        core.wait(cue_sound.getDuration())
+        if separate_audio:
+            # The buffer goes to the audio process through shared memory
+            cue_play = audio.play(audio.load(cue_tone_sequence))
+            cue_sound_duration = len(cue_tone_sequence) / 44100
+        else:
+            with profiler.phase('sound construction'):
+                cue_sound = sound.Sound(cue_tone_sequence, sampleRate=44100)
+            cue_sound.play()
+            cue_sound_duration = cue_sound.getDuration()
+        journal.log(SOUND_START, 1, cue_frequency)
+        telemetry.publish('phase', name='cue', trial=trials.thisN, coherence=coherence)
+        idle_wait(cue_sound_duration)
         
-        core.wait(wm_delay)
+        idle_wait(trial_wm_delay)
         # Play the choice tone sequence (stim 2)
-        choice_sound = sound.Sound(choice_tone_sequence, sampleRate=44100)
-        choice_sound.play()
-        core.wait(choice_sound.getDuration())
+        if separate_audio:
+            choice_play = audio.play(audio.load(choice_tone_sequence))
+            choice_sound_duration = len(choice_tone_sequence) / 44100
+        else:
+            with profiler.phase('sound construction'):
+                choice_sound = sound.Sound(choice_tone_sequence, sampleRate=44100)
+            choice_sound.play()
+            choice_sound_duration = choice_sound.getDuration()
+        journal.log(SOUND_START, 2, choice_frequency)
+        telemetry.publish('phase', name='choice', trial=trials.thisN)
+        idle_wait(choice_sound_duration)
         
 
         greenBox.draw()
         redBox.draw()
         win.flip()
         ResponsePeriodOnset = core.getTime()
+        journal.log(RESPONSE_PERIOD)
+        telemetry.publish('phase', name='response_period', trial=trials.thisN)
         responseDetected = False
         response = 'NA'
         max_response_time = 10  # Set maximum response time in seconds
 
-        while not responseDetected:
-            if greenBox.contains(mouse.getPos()):
-                response = 'same'
-                responseDetected = True
-                responseTime = core.getTime() - ResponsePeriodOnset
-            elif redBox.contains(mouse.getPos()):
-                response = 'diff'
-                responseDetected = True
-                responseTime = core.getTime() - ResponsePeriodOnset
+        with profiler.phase('response polling'):
+            while not responseDetected:
+                if greenBox.contains(mouse.getPos()):
+                    response = 'same'
+                    responseDetected = True
+                    journal.log(MOUSE_ENTER, 1)
+                    responseTime = core.getTime() - ResponsePeriodOnset
+                elif redBox.contains(mouse.getPos()):
+                    response = 'diff'
+                    responseDetected = True
+                    journal.log(MOUSE_ENTER, 2)
+                    responseTime = core.getTime() - ResponsePeriodOnset
 
-            if 'escape' in event.getKeys():
-                save_data(trial_data_list, data_file_path)
-                win.close()
-                core.quit()
+                if escape_pressed():
+                    quit_session()
 
-            if core.getTime() - ResponsePeriodOnset > max_response_time:
-                responseDetected = True
-                responseTime = max_response_time
-                response = 'NA'  # Indicate no response within time limit
+                if core.getTime() - ResponsePeriodOnset > max_response_time:
+                    responseDetected = True
+                    responseTime = max_response_time
+                    response = 'NA'  # Indicate no response within time limit
+                    journal.log(TIMEOUT, 1, max_response_time)
 
-            core.wait(0.01)
+                time.sleep(0.01)  # A poll, not a deadline, so no spinning
 
         if response == 'NA':
+            telemetry.publish('phase', name='no_response', trial=trials.thisN)
             yellowBox.draw()
             win.flip()
-            hover_detected = False
-            last_move_time = core.getTime()  # Track the last time the mouse was moved
             move_interval = 120  # Move the mouse every 2 minutes 
 
-            while not hover_detected:
+            def yellow_box_or_escape():
+                # Check for escape key to quit the experiment
+                if escape_pressed():
+                    return 'escape'
                 # Check for hover over the yellow box
                 if yellowBox.contains(mouse.getPos()):
-                    hover_detected = True
+                    journal.log(MOUSE_ENTER, 3)
+                    return 'hover'
+                return False
 
-                # Check if enough time has passed to move the mouse
-                if core.getTime() - last_move_time > move_interval:
-                    # Move the mouse slightly in a random direction
-                    current_mouse_pos = mouse.getPos()
-                    new_x = current_mouse_pos[0] + random.uniform(-10, 10)  # Move by +/-10 pixels randomly
-                    new_y = current_mouse_pos[1] + random.uniform(-10, 10)  # Move by +/-10 pixels randomly
-                    mouse.setPos((new_x, new_y))
-                    last_move_time = core.getTime()  # Reset the move timer
-
-                # Check for escape key to quit the experiment
-                if 'escape' in event.getKeys():
-                    save_data(trial_data_list, data_file_path)
-                    win.close()
-                    core.quit()
+            def nudge_mouse():
+                # Move the mouse slightly in a random direction
+                current_mouse_pos = mouse.getPos()
+                new_x = current_mouse_pos[0] + random.uniform(-10, 10)  # Move by +/-10 pixels randomly
+                new_y = current_mouse_pos[1] + random.uniform(-10, 10)  # Move by +/-10 pixels randomly
+                mouse.setPos((new_x, new_y))
 
-                # Wait for a short interval before checking again
-                core.wait(0.01)
+            # Sleep between checks instead of spinning, this can last for minutes
+            if wait_for(yellow_box_or_escape, poll=0.05, every=move_interval, callback=nudge_mouse) == 'escape':
+                quit_session()
 
         response_correct = response == correct_response
+        if adaptive and response != 'NA':
+            trials.addResponse(response_correct)
         feedback = 'Correct' if response_correct else 'Incorrect'
-        show_feedback(win, feedback)
+        with profiler.phase('feedback'):
+            show_feedback(win, feedback)
 
-        if 'escape' in event.getKeys():
-            save_data(trial_data_list, data_file_path)
-            win.close()
-            core.quit()
+        if escape_pressed():
+            quit_session()
 
         trial_data = {
             'Trial Number': trials.thisN,
@@ -205,26 +293,49 @@ try:
             'Choice Frequency Range': choice_frequency_range,
             'Coherence': coherence,
             'AltSpkrAmp': AltSpkrAmp,
-            'WM delay': wm_delay
+            'WM delay': trial_wm_delay
         }
+        performance.update(cue_frequency, choice_frequency, coherence, response_correct)
+        trial_data.update(performance.log_fields(cue_frequency, choice_frequency, coherence))
+        trial_data.update(flips.end_trial())
+        if separate_audio:
+            # Onsets as reported by the audio process, on the time.perf_counter clock
+            cue_onset = audio.wait_onset(cue_play)
+            choice_onset = audio.wait_onset(choice_play)
+            trial_data.update({'Cue Onset': cue_onset, 'Choice Onset': choice_onset,
+                               'Cue-Choice SOA (ms)': 1000 * (choice_onset - cue_onset)
+                               if cue_onset is not None and choice_onset is not None else 'NA'})
+        print(performance.status_line())
 
         trial_data_list.append(trial_data)
         win.flip()
+        telemetry.publish('trial', trial=trials.thisN, response=response, rt=responseTime,
+                          correct=response_correct, reward=response_correct, coherence=coherence,
+                          onset=ResponsePeriodOnset)
         if response_correct:
             if 'port' in globals() and port:
                 port.write(str.encode('r4'))  # REWARD
-                core.wait(1)
+                journal.log(REWARD, 1)
+                idle_wait(1)
             else:
-                core.wait(1)
+                journal.log(REWARD, 0)
+                idle_wait(1)
         else:
-            core.wait(6)
+            journal.log(TIMEOUT, 2, 6)
+            idle_wait(6)
+        journal.log(TRIAL_END, response_correct, responseTime)
 
         # Save data after each trial
-        save_data(trial_data_list, data_file_path)
-        
+        with profiler.phase('logging'):
+            save_data(trial_data_list, data_file_path)
+            journal.flush()
+            save_checkpoint(data_file_path, trials.thisN + 1, trial_log, trials if adaptive else None, performance)
+
+    save_checkpoint(data_file_path, trials.thisN, trial_log, finished=True)
 except Exception as e:
     print(f"An error occurred during the experiment: {e}")
     save_data(trial_data_list, data_file_path)
+    telemetry.close()
     # Restore the system's normal behavior after the experiment finishes
     ctypes.windll.kernel32.SetThreadExecutionState(0x80000000)
     win.close()
@@ -232,6 +343,14 @@ except Exception as e:
 finally:
     # Final save
     save_data(trial_data_list, data_file_path)
+    journal.close()
+    print(cpu_meter.report())
+    if separate_audio:
+        audio.close()
+    profile_dir = profiler.dump()
+    if profile_dir:
+        print(f"Profile written to {profile_dir}")
+    telemetry.close()
     # Restore the system's normal behavior after the experiment finishes
     ctypes.windll.kernel32.SetThreadExecutionState(0x80000000)
     win.close()
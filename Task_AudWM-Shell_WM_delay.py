@@ -1,10 +1,13 @@
-from psychopy import visual, core, event, data, gui, sound
+from psychopy import visual, core, event, sound
 import os
 from datetime import datetime
 import csv
 import numpy as np
 import random
-from Functions_WM import play_flash, load_stimuli_parameters, show_feedback, create_stereo_buffer, play_tone
+from Functions_WM import load_stimuli_parameters, show_feedback, create_stereo_buffer, play_tone
+from session_plan import compile_session, save_plan, PlanHandler
+from launch import launch_settings
+from av_scheduler import flash_train, run_timeline
 
 # Constants
 
@@ -17,11 +20,9 @@ cue_duration = 0.5  # Duration of each tone sequence
 inter_sequence_interval = inter_sequence_flashes * flash_period  # Interval between sequences
 wm_delay = 1.0 #Delay between cue and choice sounds
 
-# Set up experiment parameters via a GUI
-
+# Set up experiment parameters via a GUI, or without one from --participant/--profile
 info = {'Participant Name': ''}
-dlg = gui.DlgFromDict(dictionary=info, title='Experiment Setup')
-if not dlg.OK:
+if not launch_settings(info, title='Experiment Setup'):
     core.quit()  # User pressed cancel
 participant_name = info['Participant Name']
 seed = 12345
@@ -63,11 +64,14 @@ box_size = 200  # Static box size
 greenBox = visual.Rect(win, width=box_size, height=box_size, pos=(-300, 0), fillColor='green')
 redBox = visual.Rect(win, width=box_size, height=box_size, pos=(300, 0), fillColor='red')
 flash_stim = visual.Rect(win, size=(200, 200), pos=(0, 0), fillColor='white')
+frame_rate = win.getActualFrameRate() or 60  # measured once, used to lock the flashes to flips
 stimuli_parameters = load_stimuli_parameters(csv_filename)
 
 # Auditory stimulus setup
 
-trials = data.TrialHandler(stimuli_parameters, nReps=100, method='random')
+plan = compile_session(stimuli_parameters, nReps=100, method='random', wm_delay=wm_delay)
+save_plan(plan, data_file_path)  # trial order of this session, next to the data file
+trials = PlanHandler(plan)
 
 # Create a mouse object
 
@@ -77,13 +81,13 @@ trial_data_list = []
 # Main experiment loop
 for trial in trials:
     current_params = trial
-    # Convert parameters to the correct type (all values read from CSV are strings)
-    cue_frequency = float(current_params['cue_frequency'])
-    cue_frequency_range = float(current_params['cue_frequency_range'])
-    choice_frequency = float(current_params['choice_frequency'])
-    choice_frequency_range = float(current_params['choice_frequency_range'])
-    coherence = float(current_params['coherence'])
-    correct_response = 'same' if cue_frequency == choice_frequency else 'diff'
+    # Typed parameters from the compiled session plan
+    cue_frequency = current_params['cue_frequency']
+    cue_frequency_range = current_params['cue_frequency_range']
+    choice_frequency = current_params['choice_frequency']
+    choice_frequency_range = current_params['choice_frequency_range']
+    coherence = current_params['coherence']
+    correct_response = current_params['correct_response']
 
     if cue_frequency == choice_frequency:
         play_tone(cue_frequency, left=True)
@@ -94,9 +98,9 @@ for trial in trials:
         core.wait(wm_delay)
         play_tone(choice_frequency, left=False)
 
-    for i in range(inter_sequence_flashes):
-        play_flash(win, flash_stim, flash_duration)
-        core.wait(flash_period - flash_duration)
+    if inter_sequence_flashes:
+        run_timeline(win, flash_train(flash_stim, inter_sequence_flashes, flash_period, flash_duration),
+                     frame_rate=frame_rate)
 
     greenBox.draw()
     redBox.draw()
@@ -3,7 +3,7 @@
 # stereo related edits by Yash
 # June 2024
 
-from psychopy import visual, core, event, data, gui, sound
+from psychopy import visual, core, event, sound
 import os
 from datetime import datetime
 import csv
@@ -11,9 +11,14 @@ import numpy as np
 import random
 import ctypes
 ctypes.windll.kernel32.SetThreadExecutionState(0x80000002) # prevent WINDOWS machine from sleeping
-from Functions_WM import play_flash, load_stimuli_parameters, show_feedback, create_stereo_buffer, play_tone
-import serial
-port = serial.Serial("COM4",115200) # serial port and baud rate for dell xps laptop
+from Functions_WM import load_stimuli_parameters, show_feedback
+from reward_daemon import open_reward_port
+from spatial_bank import SpatialBank
+from session_plan import compile_session, save_plan, PlanHandler
+from launch import launch_settings
+from av_scheduler import flash_train, run_timeline
+from warmup import warm_up
+port = open_reward_port("COM4",115200) # serial port and baud rate for dell xps laptop, shared through reward_daemon.py if it runs
 
 # Constants
 AltSpkrAmp = 0.2
@@ -26,10 +31,9 @@ cue_duration = 0.5  # Duration of each tone sequence
 inter_sequence_interval = inter_sequence_flashes * flash_period  # Interval between sequences
 wm_delay = 0.3  # Delay between cue and choice sounds
 
-# Set up experiment parameters via a GUI
+# Set up experiment parameters via a GUI, or without one from --participant/--profile
 info = {'Participant Name': ''}
-dlg = gui.DlgFromDict(dictionary=info, title='Experiment Setup')
-if not dlg.OK:
+if not launch_settings(info, title='Experiment Setup'):
     core.quit()  # User pressed cancel
 participant_name = info['Participant Name']
 seed = 12345
@@ -66,11 +70,25 @@ box_size = 200  # Static box size
 greenBox = visual.Rect(win, width=box_size, height=box_size, pos=(-300, 0), fillColor='green')
 redBox = visual.Rect(win, width=box_size, height=box_size, pos=(300, 0), fillColor='red')
 flash_stim = visual.Rect(win, size=(200, 200), pos=(0, 0), fillColor='white')
+frame_rate = win.getActualFrameRate() or 60  # measured once, used to lock the flashes to flips
 yellowBox = visual.Rect(win, width=box_size, height=box_size, pos=(0, 0), fillColor='yellow')
 stimuli_parameters = load_stimuli_parameters(csv_filename)
 
+# Every tone of the soundslist rendered once per speaker side
+spatial_bank = SpatialBank.from_parameters(stimuli_parameters,
+                                           {'left': {'left_amp': 1.0, 'right_amp': AltSpkrAmp},
+                                            'right': {'left_amp': AltSpkrAmp, 'right_amp': 1.0}})
+
+# Warm up audio and window, and build the bank's sounds before trial 0
+startup = warm_up(win, stimuli=[greenBox, redBox, flash_stim, yellowBox])
+startup.measure('sound bank', spatial_bank.prepare_sounds, repeats=1)
+startup.save(data_file_path)
+print(startup.summary())
+
 # Auditory stimulus setup
-trials = data.TrialHandler(stimuli_parameters, nReps=200, method='random')
+plan = compile_session(stimuli_parameters, nReps=200, method='random', wm_delay=wm_delay)
+save_plan(plan, data_file_path)  # trial order of this session, next to the data file
+trials = PlanHandler(plan)
 
 # Create a mouse object
 mouse = event.Mouse(win=win)
@@ -94,27 +112,27 @@ try:
         # Move mouse off screen
         mouse.setPos(newPos=(win.size[0] * 1.5, win.size[1] * 1.5))
         #mouse.setVisible(False)
-        # Convert parameters to the correct type (all values read from CSV are strings)
-        cue_frequency = float(current_params['cue_frequency'])
-        cue_frequency_range = float(current_params['cue_frequency_range'])
-        choice_frequency = float(current_params['choice_frequency'])
-        choice_frequency_range = float(current_params['choice_frequency_range'])
-        coherence = float(current_params['coherence'])
-        correct_response = 'same' if cue_frequency == choice_frequency else 'diff'
+        # Typed parameters from the compiled session plan
+        cue_frequency = current_params['cue_frequency']
+        cue_frequency_range = current_params['cue_frequency_range']
+        choice_frequency = current_params['choice_frequency']
+        choice_frequency_range = current_params['choice_frequency_range']
+        coherence = current_params['coherence']
+        correct_response = current_params['correct_response']
 
         # Section of the script that plays the stimulus
         if cue_frequency == choice_frequency:
-            play_tone(cue_frequency, 1.0, AltSpkrAmp)
+            spatial_bank.play(cue_frequency, 'left')
             core.wait(wm_delay)
-            play_tone(choice_frequency, 1.0, AltSpkrAmp)
+            spatial_bank.play(choice_frequency, 'left')
         else:
-            play_tone(cue_frequency, AltSpkrAmp, 1.0)
+            spatial_bank.play(cue_frequency, 'right')
             core.wait(wm_delay)
-            play_tone(choice_frequency, AltSpkrAmp, 1.0)
+            spatial_bank.play(choice_frequency, 'right')
 
-        for i in range(inter_sequence_flashes):
-            play_flash(win, flash_stim, flash_duration)
-            core.wait(flash_period - flash_duration)
+        if inter_sequence_flashes:
+            run_timeline(win, flash_train(flash_stim, inter_sequence_flashes, flash_period, flash_duration),
+                         frame_rate=frame_rate)
 
         greenBox.draw()
         redBox.draw()
@@ -0,0 +1,173 @@
+"""
+QUEST+ style adaptive selection of coherence (and optionally WM delay)
+
+The psychometric function for the same/diff task is
+
+    p(correct) = guess + (1 - guess - lapse) * logistic(slope * (coherence - threshold - delay_cost * wm_delay))
+
+The likelihood of every (stimulus, outcome, parameter) combination is
+computed once on a fixed grid, so picking the next stimulus and updating the
+posterior are a handful of vectorized array operations that comfortably fit
+inside the ITI.
+
+Usage in a shell, in place of data.TrialHandler:
+
+    trials = QuestPlusHandler(stimuli_parameters, nTrials=400, coherences=np.round(np.linspace(0.5, 1.0, 11), 2))
+    for trial in trials:
+        ...
+        trials.addResponse(response_correct)
+"""
+
+import numpy as np
+
+
+class QuestPlus:
+    """Posterior over psychometric parameters on a precomputed grid
+
+    Args:
+        coherences: Coherence levels that may be presented
+        wm_delays: WM delays (s) that may be presented. If None the delay is
+            not adapted and the delay_cost parameter is dropped
+        thresholds: Grid of thresholds (coherence units)
+        slopes: Grid of logistic slopes
+        lapses: Grid of lapse rates
+        delay_costs: Grid of threshold shifts per second of WM delay
+        guess: Chance performance (0.5 for same/diff)
+
+    """
+
+    def __init__(self, coherences, wm_delays=None,
+                 thresholds=np.linspace(0.3, 1.0, 29),
+                 slopes=np.geomspace(2, 60, 15),
+                 lapses=np.array([0.0, 0.02, 0.05, 0.1]),
+                 delay_costs=np.linspace(0.0, 0.2, 9),
+                 guess=0.5):
+
+        self.coherences = np.asarray(coherences, dtype=float)
+        if wm_delays is None:
+            wm_delays = [0.0]
+            delay_costs = [0.0]
+        self.wm_delays = np.asarray(wm_delays, dtype=float)
+
+        # Stimulus grid: every (coherence, wm_delay) combination
+        coh, delay = np.meshgrid(self.coherences, self.wm_delays, indexing='ij')
+        self.stim_domain = np.column_stack((coh.ravel(), delay.ravel()))
+
+        # Parameter grid: every (threshold, slope, lapse, delay_cost) combination
+        grids = np.meshgrid(thresholds, slopes, lapses, delay_costs, indexing='ij')
+        self.param_domain = np.column_stack([g.ravel() for g in grids])
+        thr, slp, lps, cost = self.param_domain.T
+
+        # Likelihood of a correct response, shape (n_stim, n_params)
+        c = self.stim_domain[:, [0]]
+        d = self.stim_domain[:, [1]]
+        p_correct = guess + (1 - guess - lps) / (1 + np.exp(-slp * (c - thr - cost * d)))
+
+        # Stack as (n_stim, 2 outcomes, n_params): outcome 0 = incorrect, 1 = correct
+        self.likelihoods = np.stack((1 - p_correct, p_correct), axis=1)
+
+        self.posterior = np.full(len(self.param_domain), 1.0 / len(self.param_domain))
+
+    def next_stim(self):
+        """Index into stim_domain of the stimulus with the lowest expected posterior entropy"""
+
+        # Probability of each outcome for each stimulus
+        unnorm = self.likelihoods * self.posterior
+        p_outcome = unnorm.sum(axis=2, keepdims=True)
+
+        # Entropy of the posterior that would follow each outcome
+        post = unnorm / p_outcome
+        with np.errstate(divide='ignore', invalid='ignore'):
+            h = -np.nansum(post * np.log(post), axis=2)
+
+        expected_h = (h * p_outcome[..., 0]).sum(axis=1)
+        return int(np.argmin(expected_h))
+
+    def update(self, stim_idx, correct):
+        """Update the posterior with the outcome of one trial
+
+        Args:
+            stim_idx: Index into stim_domain of the presented stimulus
+            correct: Whether the response was correct
+
+        """
+        self.posterior *= self.likelihoods[stim_idx, int(bool(correct))]
+        self.posterior /= self.posterior.sum()
+
+    def estimate(self):
+        """Posterior mean of each parameter
+
+        Returns:
+            dict with threshold, slope, lapse and delay_cost
+
+        """
+        mean = self.posterior @ self.param_domain
+        return dict(zip(['threshold', 'slope', 'lapse', 'delay_cost'], mean))
+
+
+class QuestPlusHandler:
+    """Drop-in replacement for data.TrialHandler that adapts coherence
+
+    Each trial is a randomly chosen row of the soundslist with its
+    'coherence' (and 'wm_delay' if wm_delays is given) replaced by the value
+    QUEST+ picked. Call addResponse after every trial with a valid response;
+    trials without one (e.g. 'NA') are simply not used for the update.
+
+    Args:
+        trialList: list of dicts as returned by load_stimuli_parameters
+        nTrials: Number of trials to run
+        coherences: Coherence levels that may be presented
+        wm_delays: Optional WM delays (s) that may be presented
+        seed: Seed for choosing the soundslist rows
+        **kwargs: Passed on to QuestPlus
+
+    """
+
+    def __init__(self, trialList, nTrials, coherences, wm_delays=None, seed=None, **kwargs):
+        self._args = (trialList, nTrials, coherences, wm_delays, seed, kwargs)
+        self.trialList = trialList
+        self.nTotal = nTrials
+        self.quest = QuestPlus(coherences, wm_delays=wm_delays, **kwargs)
+        self.adaptDelay = wm_delays is not None
+        self.rng = np.random.RandomState(seed)
+        self.thisN = -1
+        self.thisTrial = None
+        self._stimIdx = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.thisN += 1
+        if self.thisN >= self.nTotal:
+            raise StopIteration
+
+        self._stimIdx = self.quest.next_stim()
+        coherence, wm_delay = self.quest.stim_domain[self._stimIdx]
+
+        trial = dict(self.trialList[self.rng.randint(len(self.trialList))])
+        trial['coherence'] = float(coherence)
+        if self.adaptDelay:
+            trial['wm_delay'] = float(wm_delay)
+        self.thisTrial = trial
+        return trial
+
+    def __getstate__(self):
+        # Pickle (e.g. for checkpoints) only what a rebuilt grid cannot know
+        return {'args': self._args, 'posterior': self.quest.posterior, 'rng': self.rng.get_state(),
+                'thisN': self.thisN, 'thisTrial': self.thisTrial, 'stimIdx': self._stimIdx}
+
+    def __setstate__(self, state):
+        trialList, nTrials, coherences, wm_delays, seed, kwargs = state['args']
+        self.__init__(trialList, nTrials, coherences, wm_delays, seed, **kwargs)
+        self.quest.posterior = state['posterior']
+        self.rng.set_state(state['rng'])
+        self.thisN = state['thisN']
+        self.thisTrial = state['thisTrial']
+        self._stimIdx = state['stimIdx']
+
+    def addResponse(self, correct):
+        """Feed the outcome of the current trial back into the posterior"""
+        if self._stimIdx is not None:
+            self.quest.update(self._stimIdx, correct)
+            self._stimIdx = None
@@ -0,0 +1,273 @@
+"""
+Audio playback in a separate process
+
+The shells build and start their sounds in the same thread that polls the
+mouse and flips the window, so a slow frame or a garbage collection pause
+delays the sound onset. AudioProcess moves playback to its own process:
+stimulus buffers live in a shared memory block of slots that the audio
+process plays straight from (the task writes a buffer once, nothing is
+pickled or copied again), and play commands go over a local connection. The
+audio process is started as its own script (python audio_process.py ...),
+so it never re-runs the task shell that starts it. It reports the time the
+first sample of every sound reached the output, on the time.perf_counter
+clock, which is the same in every process on a machine.
+
+    audio = AudioProcess(samplingRate=44100)
+    audio.start()
+    play_id = audio.play(audio.load(cue_tone_sequence))
+    cue_onset = audio.wait_onset(play_id)
+    ...
+    audio.close()
+
+Output goes through the sinks of audio_stream: SoundDeviceSink, or NullSink
+to run without an audio device. Only one sound plays at a time; a new play
+command cuts off the current sound.
+"""
+
+import argparse
+import collections
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+
+def serve(address, authkey, shm_name, shape, samplingRate, block_size, sink_name, device=None):
+    """Body of the audio process: pass commands from the connection to the sink callback"""
+    from audio_stream import NullSink, SoundDeviceSink
+
+    conn = Client(address, authkey=authkey)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    if os.name == 'posix':
+        # The task owns the block; keep this process's resource tracker from removing it on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    buffers = np.ndarray(shape, dtype='float32', buffer=shm.buf)
+    sink = SoundDeviceSink(samplingRate, device) if sink_name == 'sounddevice' else NullSink(samplingRate)
+
+    pending = collections.deque()  # Commands handed from the main thread to the callback
+    reports = collections.deque()  # Onsets handed from the callback back to the main thread
+    current = []  # [slot, n_samples, position, play_id] of the sound playing
+
+    def callback(outdata, frames, time_info=None, status=None):
+        now = time.perf_counter()
+        # Time the first sample of this block reaches the output
+        dac = now if time_info is None else now + time_info.outputBufferDacTime - time_info.currentTime
+        outdata[:] = 0
+        start = 0
+        # Only this callback pops from pending and only the main thread appends
+        while pending:
+            if pending[0][0] == 'stop':
+                pending.popleft()
+                current.clear()
+                continue
+            if any(item[0] == 'stop' for item in pending):
+                pending.popleft()  # Dropped by a later stop
+                continue
+            _, slot, n_samples, when, play_id = pending[0]
+            start = 0 if when is None else int(round((when - dac) * samplingRate))
+            if start >= frames:
+                start = 0
+                break  # Scheduled for a later block
+            pending.popleft()
+            start = max(start, 0)
+            current[:] = [slot, n_samples, 0, play_id]
+            reports.append(('onset', play_id, dac + start / samplingRate, when))
+            break
+        if current:
+            slot, n_samples, pos, play_id = current
+            n = min(n_samples - pos, frames - start)
+            outdata[start:start + n] = buffers[slot, pos:pos + n]
+            current[2] += n
+            if current[2] >= n_samples:
+                reports.append(('finished', play_id, dac + (start + n) / samplingRate, None))
+                current.clear()
+
+    sink.start(callback, block_size)
+    conn.send(('ready', None, time.perf_counter(), None))
+    try:
+        while True:
+            while reports:
+                conn.send(reports.popleft())
+            if not conn.poll(0.002):
+                continue
+            command = conn.recv()
+            if command[0] == 'quit':
+                break
+            pending.append(command)
+    except EOFError:
+        pass  # The task went away
+    finally:
+        sink.stop()
+        del buffers
+        shm.close()
+        conn.close()
+
+
+class AudioProcess:
+    """Plays stimulus buffers from shared memory in a separate process
+
+    Args:
+        samplingRate: Output sampling rate
+        slots: Number of buffers that can be loaded at once
+        max_seconds: Longest sound a slot can hold
+        block_size: Samples per audio callback
+        sink: 'sounddevice' for the audio device, 'null' for no output
+        device: sounddevice device index or name. None for the default output
+
+    """
+
+    def __init__(self, samplingRate=44100, slots=4, max_seconds=1.0, block_size=256, sink='sounddevice',
+                 device=None):
+        self.samplingRate = samplingRate
+        self.shape = (slots, int(samplingRate * max_seconds), 2)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)) * 4)
+        self.buffers = np.ndarray(self.shape, dtype='float32', buffer=self.shm.buf)
+        self.lengths = np.zeros(slots, dtype=int)
+        self.block_size = block_size
+        self.sink = sink
+        self.device = device
+        self.process = None
+        self.conn = None
+        self._next_slot = itertools.cycle(range(slots))
+        self._ids = itertools.count()
+        self._onsets = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def start(self, timeout=5.0):
+        """Start the audio process and wait until its output is running"""
+        authkey = os.urandom(16)
+        listener = Listener(('127.0.0.1', 0), authkey=authkey)
+        args = [sys.executable, os.path.abspath(__file__), '--address', f"{listener.address[0]}:{listener.address[1]}",
+                '--authkey', authkey.hex(), '--shm', self.shm.name, '--shape', ','.join(map(str, self.shape)),
+                '--rate', str(self.samplingRate), '--block-size', str(self.block_size), '--sink', self.sink]
+        if self.device is not None:
+            args += ['--device', str(self.device)]
+        self.process = subprocess.Popen(args)
+
+        # accept() has no timeout, so wait for it in a thread
+        accepted = []
+        waiter = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        listener.close()
+        if accepted:
+            self.conn = accepted[0]
+            try:
+                if self.conn.poll(timeout):
+                    self.conn.recv()  # ready
+                    return
+            except EOFError:
+                pass  # It failed after connecting, e.g. without an audio device
+        self.close()
+        raise RuntimeError("Audio process did not start")
+
+    def buffer(self, slot):
+        """Writable view of a slot, to render a stimulus straight into shared memory"""
+        return self.buffers[slot]
+
+    def load(self, sound_array, slot=None):
+        """Copy a mono or stereo array into a slot
+
+        Args:
+            sound_array: (n,) or (n, 2) array
+            slot: Slot to use. The next one in turn if None; do not load into a
+                slot that is still playing
+
+        Returns:
+            The slot index, to pass to play
+
+        """
+        slot = next(self._next_slot) if slot is None else slot
+        sound_array = np.asarray(sound_array, dtype='float32')
+        n = len(sound_array)
+        if n > self.shape[1]:
+            raise ValueError(f"Sound of {n} samples does not fit a slot of {self.shape[1]}")
+        self.buffers[slot, :n] = sound_array if sound_array.ndim == 2 else sound_array[:, None]
+        self.lengths[slot] = n
+        return slot
+
+    def play(self, slot, when=None, n_samples=None):
+        """Play a loaded slot
+
+        Args:
+            slot: Slot returned by load
+            when: time.perf_counter() time for the first sample to reach the
+                output. None plays as soon as possible
+            n_samples: Samples to play. The length given to load if None
+
+        Returns:
+            Id of this play, for wait_onset
+
+        """
+        play_id = next(self._ids)
+        n_samples = self.lengths[slot] if n_samples is None else n_samples
+        self.conn.send(('play', slot, int(n_samples), when, play_id))
+        return play_id
+
+    def stop(self):
+        """Cut off the current sound and drop scheduled ones"""
+        self.conn.send(('stop',))
+
+    def _collect(self, timeout):
+        if not self.conn.poll(timeout):
+            return
+        kind, play_id, t, _ = self.conn.recv()
+        (self._onsets if kind == 'onset' else self._finished)[play_id] = t
+
+    def wait_onset(self, play_id, timeout=2.0):
+        """perf_counter time the play reached the output, or None on timeout"""
+        return self._wait(self._onsets, play_id, timeout)
+
+    def wait_finished(self, play_id, timeout=2.0):
+        """perf_counter time the last sample of the play reached the output, or None on timeout"""
+        return self._wait(self._finished, play_id, timeout)
+
+    def _wait(self, table, play_id, timeout):
+        deadline = time.perf_counter() + timeout
+        with self._lock:
+            while play_id not in table:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._collect(remaining)
+            return table.pop(play_id)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.conn.send(('quit',))
+                self.process.wait(2.0)
+            except (AttributeError, OSError, subprocess.TimeoutExpired):
+                self.process.terminate()
+        if self.conn is not None:
+            self.conn.close()
+        del self.buffers
+        self.shm.close()
+        self.shm.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Audio process started by AudioProcess')
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--authkey', required=True)
+    parser.add_argument('--shm', required=True)
+    parser.add_argument('--shape', required=True)
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--block-size', type=int, default=256)
+    parser.add_argument('--sink', default='sounddevice')
+    parser.add_argument('--device', default=None)
+    args = parser.parse_args()
+
+    host, port = args.address.rsplit(':', 1)
+    device = int(args.device) if args.device is not None and args.device.isdigit() else args.device
+    serve((host, int(port)), bytes.fromhex(args.authkey), args.shm, tuple(int(n) for n in args.shape.split(',')),
+          args.rate, args.block_size, args.sink, device)
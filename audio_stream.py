@@ -0,0 +1,224 @@
+"""
+Streaming audio output for long continuous stimulus streams
+
+createAudioStream has to build the whole repeated stream before a
+sound.Sound can play it. Here a stream is a generator pipeline of fixed-size
+float32 blocks (stimulus source -> gain/pan -> output) that a background
+thread keeps a bounded queue of, and the audio callback pops one block per
+call. Memory and latency stay constant whatever the length of the stream;
+a callback that finds the queue empty plays silence and counts an underrun.
+
+    blocks = gain_pan(repeat_source(click, soa=0.5, samplingRate=48000, reps=None), 1.0, 0.5)
+    player = StreamPlayer(blocks, SoundDeviceSink(48000))
+    player.start()
+    ...
+    player.stop()
+
+NullSink consumes blocks on a clock without any audio device, for testing.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from tone_synthesis import to_stereo
+
+
+def repeat_source(arr, soa, samplingRate, reps=None, blanks=[], block_size=512):
+    """Blocks of arr repeated every soa seconds, like createAudioStream but lazily
+
+    Args:
+        arr: Mono signal to repeat
+        soa: Sound Onset Asynchrony. Time between onsets of repetitions
+        samplingRate: Auditory sampling rate
+        reps: Number of repetitions. None repeats forever
+        blanks: Repetitions (1-based) that should be silent
+        block_size: Samples per block
+
+    Yields:
+        float32 mono blocks of block_size samples (the last one zero padded)
+
+    """
+    arr = np.asarray(arr, dtype='float32')
+    period = max(round(samplingRate * soa), len(arr))
+    if not isinstance(blanks, list):
+        blanks = [blanks]
+    blankReps = set(b - 1 for b in blanks)
+
+    block = np.zeros(block_size, dtype='float32')
+    pos = 0  # Sample index of the start of the current block in the stream
+    while reps is None or pos < reps * period:
+        block[:] = 0
+        # Repetitions overlapping this block
+        first = pos // period
+        last = (pos + block_size - 1) // period
+        for rep in range(first, last + 1):
+            if (reps is not None and rep >= reps) or rep in blankReps:
+                continue
+            start = rep * period - pos  # Onset of this repetition within the block
+            lo = max(start, 0)
+            hi = min(start + len(arr), block_size)
+            if hi > lo:
+                block[lo:hi] = arr[lo - start:hi - start]
+        yield block.copy()
+        pos += block_size
+
+
+def array_source(arr, block_size=512):
+    """Blocks of an existing mono array"""
+    arr = np.asarray(arr, dtype='float32')
+    for start in range(0, len(arr), block_size):
+        block = arr[start:start + block_size]
+        if len(block) < block_size:
+            block = np.concatenate((block, np.zeros(block_size - len(block), dtype='float32')))
+        yield block
+
+
+def gain_pan(blocks, left_amp=1.0, right_amp=1.0):
+    """Expand mono blocks to stereo with per-channel gains"""
+    for block in blocks:
+        yield to_stereo(block, left_amp, right_amp)
+
+
+class StreamPlayer:
+    """Feed a block pipeline to an audio sink through a bounded queue
+
+    Args:
+        blocks: Iterable of (block_size, 2) float32 blocks, e.g. from gain_pan
+        sink: Output with start(callback, block_size) and stop(), e.g.
+            SoundDeviceSink or NullSink
+        block_size: Samples per block
+        max_blocks: Blocks buffered ahead of the callback. With block_size
+            this bounds the latency from pipeline to output
+
+    """
+
+    def __init__(self, blocks, sink, block_size=512, max_blocks=8):
+        self.blocks = iter(blocks)
+        self.sink = sink
+        self.block_size = block_size
+        self.queue = queue.Queue(maxsize=max_blocks)
+        self.underruns = 0
+        self.blocks_played = 0
+        self.finished = threading.Event()
+        self._stop = threading.Event()
+        self._producer = threading.Thread(target=self._produce, name='audio-producer', daemon=True)
+
+    def _produce(self):
+        for block in self.blocks:
+            while not self._stop.is_set():
+                try:
+                    self.queue.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if self._stop.is_set():
+                return
+        self.queue.put(None)
+
+    def callback(self, outdata, frames, time_info=None, status=None):
+        """Audio callback: copy the next block into outdata, silence on underrun"""
+        if self.finished.is_set():
+            outdata[:] = 0
+            return
+        try:
+            block = self.queue.get_nowait()
+        except queue.Empty:
+            outdata[:] = 0
+            self.underruns += 1
+            return
+        if block is None:
+            outdata[:] = 0
+            self.finished.set()
+            return
+        outdata[:] = block[:frames]
+        self.blocks_played += 1
+
+    def start(self, prefill=True):
+        """Start producing and playing. With prefill, wait for the queue to fill first"""
+        self._producer.start()
+        if prefill:
+            while not self.queue.full() and self._producer.is_alive():
+                time.sleep(0.001)
+        self.sink.start(self.callback, self.block_size)
+
+    def wait(self, timeout=None):
+        """Block until the stream has been played to the end"""
+        return self.finished.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self.sink.stop()
+        self._producer.join(1.0)
+
+    @property
+    def latency(self):
+        """Worst-case seconds between a block leaving the pipeline and being played"""
+        return self.queue.maxsize * self.block_size / self.sink.samplingRate
+
+
+class SoundDeviceSink:
+    """Audio device output through the sounddevice package
+
+    Args:
+        samplingRate: Output sampling rate
+        device: sounddevice device index or name. None for the default output
+
+    """
+
+    def __init__(self, samplingRate=48000, device=None):
+        self.samplingRate = samplingRate
+        self.device = device
+        self.stream = None
+
+    def start(self, callback, block_size):
+        import sounddevice as sd
+        self.stream = sd.OutputStream(samplerate=self.samplingRate, blocksize=block_size, channels=2,
+                                      dtype='float32', device=self.device, callback=callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+class NullSink:
+    """Consumes blocks like an audio device would, without producing sound
+
+    Args:
+        samplingRate: Pretend sampling rate
+        realtime: Call back at the rate a device would. If False, as fast as possible
+
+    """
+
+    def __init__(self, samplingRate=48000, realtime=True):
+        self.samplingRate = samplingRate
+        self.realtime = realtime
+        self.blocks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, callback, block_size):
+        outdata = np.zeros((block_size, 2), dtype='float32')
+        period = block_size / self.samplingRate
+
+        def run():
+            next_time = time.perf_counter()
+            while not self._stop.is_set():
+                callback(outdata, block_size)
+                self.blocks += 1
+                if self.realtime:
+                    next_time += period
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+
+        self._thread = threading.Thread(target=run, name='null-sink', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
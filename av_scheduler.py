@@ -0,0 +1,101 @@
+"""
+Frame-locked scheduling of flash trains and sound onsets
+
+A timeline is a list of events with onsets in seconds. run_timeline turns
+every onset into a frame count, then flips once per frame: flashes are
+switched on and off with setAutoDraw on their first and last frame and
+sounds are started from win.callOnFlip, so both are tied to the same flips
+and errors no longer add up across a train of core.wait calls.
+
+    timeline = flash_train(flash_stim, n=3, period=flash_period, duration=flash_duration)
+    timeline.append(sound_event(cue_sound, onset=3 * flash_period))
+    report = run_timeline(win, timeline)
+"""
+
+from collections import defaultdict
+
+from psychopy import core
+
+
+def flash_event(stim, onset, duration):
+    """A visual stimulus shown from onset for duration seconds"""
+    return {'kind': 'flash', 'stim': stim, 'onset': onset, 'duration': duration}
+
+
+def sound_event(snd, onset, label='sound'):
+    """A sound started at onset seconds"""
+    return {'kind': 'sound', 'sound': snd, 'onset': onset, 'duration': snd.getDuration(), 'label': label}
+
+
+def flash_train(stim, n, period, duration, start=0.0):
+    """n flashes of duration seconds, one every period seconds from start"""
+    return [flash_event(stim, start + ii * period, duration) for ii in range(n)]
+
+
+def run_timeline(win, timeline, frame_rate=None):
+    """Play a timeline of flashes and sounds locked to the screen refresh
+
+    Args:
+        win: The window object
+        timeline: List of events from flash_event / sound_event / flash_train
+        frame_rate: Refresh rate in Hz. Measured from the window if None, which
+            takes a moment, so pass it in when running a timeline every trial
+
+    Returns:
+        List of dicts, one per event in onset order, with the requested and
+        realized onset (s, relative to the first flip of the timeline), the
+        error (ms) and, for flashes, the requested and realized duration
+
+    """
+    if frame_rate is None:
+        frame_rate = win.getActualFrameRate() or 60.0
+    period = 1.0 / frame_rate
+
+    # Frame of every onset and offset
+    events = sorted(timeline, key=lambda ev: ev['onset'])
+    starts = defaultdict(list)
+    stops = defaultdict(list)
+    for ev in events:
+        ev['start_frame'] = int(round(ev['onset'] / period))
+        ev['stop_frame'] = ev['start_frame'] + max(1, int(round(ev['duration'] / period)))
+        starts[ev['start_frame']].append(ev)
+        stops[ev['stop_frame']].append(ev)
+    n_frames = max(ev['stop_frame'] for ev in events) if events else 0
+
+    def play(ev):
+        ev['sound'].play()
+        ev['played_at'] = core.getTime()
+
+    first_flip = None
+    for frame in range(n_frames + 1):
+        for ev in stops[frame]:
+            if ev['kind'] == 'flash':
+                ev['stim'].setAutoDraw(False)
+        for ev in starts[frame]:
+            if ev['kind'] == 'flash':
+                ev['stim'].setAutoDraw(True)
+            else:
+                win.callOnFlip(play, ev)
+
+        flip_time = win.flip()
+        if flip_time is None:
+            flip_time = core.getTime()
+        if first_flip is None:
+            first_flip = flip_time
+
+        for ev in starts[frame]:
+            ev['realized_onset'] = (ev.get('played_at', flip_time)) - first_flip
+        for ev in stops[frame]:
+            ev['realized_offset'] = flip_time - first_flip
+
+    report = []
+    for ev in events:
+        row = {'kind': ev['kind'] if ev['kind'] == 'flash' else ev['label'],
+               'requested_onset': ev['onset'], 'frame': ev['start_frame'],
+               'realized_onset': ev['realized_onset'],
+               'error_ms': (ev['realized_onset'] - ev['onset']) * 1000}
+        if ev['kind'] == 'flash':
+            row['requested_duration'] = ev['duration']
+            row['realized_duration'] = ev['realized_offset'] - ev['realized_onset']
+        report.append(row)
+    return report
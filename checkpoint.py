@@ -0,0 +1,132 @@
+"""
+Crash-safe checkpoints and resume of a running session
+
+After every trial the shell appends the new rows to its CSV through
+TrialLog and writes a small checkpoint next to it: the index of the next
+trial, the numpy and random RNG states, the QUEST+ handler when adaptive
+(its posterior, RNG and counters; the likelihood grid is rebuilt on load),
+the running performance, and the byte offset the CSV had reached. The
+checkpoint is written to a temporary file and moved into place, so a crash
+leaves either the previous or the new checkpoint, never half of one.
+
+On the next start with resume enabled, find_resumable returns the newest
+unfinished checkpoint of the participant. The shell then reloads the saved
+session plan, starts it at the next trial, restores the RNG states, and
+TrialLog cuts the CSV back to the checkpointed offset (dropping a trial
+that was half written when it crashed) and keeps appending to it. Past
+trials are not re-read.
+"""
+
+import csv
+import glob
+import os
+import pickle
+import random
+import re
+import time
+
+import numpy as np
+
+
+def checkpoint_path(data_file_path):
+    """Path of the checkpoint belonging to a data file"""
+    return os.path.splitext(data_file_path)[0] + '_checkpoint.pkl'
+
+
+class TrialLog:
+    """Append-only CSV of the trial data
+
+    Unlike rewriting the whole file after every trial, only rows not yet
+    written are appended, and the offset reached is known for checkpoints.
+
+    Args:
+        data_file_path: CSV file
+        fieldnames: Columns, as in the first row. None takes them from the first row written
+        offset: Resume an existing file, truncating it to this byte offset
+
+    """
+
+    def __init__(self, data_file_path, fieldnames=None, offset=None):
+        self.data_file_path = data_file_path
+        self.fieldnames = list(fieldnames) if fieldnames is not None else None
+        self.synced = 0  # Rows of the current run's trial list already written
+        if offset is not None:
+            with open(data_file_path, 'r+b') as f:
+                f.truncate(offset)
+            self.offset = offset
+        else:
+            self.offset = 0
+
+    def sync(self, trial_data_list):
+        """Append the rows of trial_data_list added since the last call"""
+        rows = trial_data_list[self.synced:]
+        if not rows:
+            return
+        with open(self.data_file_path, 'a', newline='') as f:
+            if self.fieldnames is None:
+                self.fieldnames = list(rows[0].keys())
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction='ignore', lineterminator='\n')
+            if self.offset == 0:
+                writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            self.offset = f.tell()
+        self.synced += len(rows)
+
+
+def save_checkpoint(data_file_path, next_trial, log, adaptive_handler=None, performance=None, finished=False):
+    """Atomically write the state needed to continue the session at next_trial
+
+    Args:
+        data_file_path: CSV file of the session
+        next_trial: Index of the first trial not yet completed
+        log: TrialLog of the session
+        adaptive_handler: QuestPlusHandler to restore, if adaptive
+        performance: PerformanceTracker to restore
+        finished: Mark the session as complete so it is not offered for resume
+
+    """
+    state = {
+        'data_file_path': data_file_path,
+        'next_trial': next_trial,
+        'log_offset': log.offset,
+        'fieldnames': log.fieldnames,
+        'np_random': np.random.get_state(),
+        'random': random.getstate(),
+        'adaptive': adaptive_handler,
+        'performance': performance,
+        'finished': finished,
+        'time': time.time(),
+    }
+    path = checkpoint_path(data_file_path)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def find_resumable(data_folder_path, participant_name):
+    """Newest unfinished checkpoint of a participant, or None"""
+    # Only <participant>_<YYYYmmdd-HHMMSS>, so 'fr' does not pick up 'fr_x_...'
+    pattern = re.compile(re.escape(participant_name) + r'_\d{8}-\d{6}_checkpoint\.pkl')
+    paths = [path for path in glob.glob(os.path.join(glob.escape(data_folder_path), '*_checkpoint.pkl'))
+             if pattern.fullmatch(os.path.basename(path))]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True):
+        state = load_checkpoint(path)
+        if not state['finished'] and os.path.exists(state['data_file_path']):
+            return state
+    return None
+
+
+def restore_random_state(state):
+    """Put numpy's and random's global RNGs back where the checkpoint left them"""
+    np.random.set_state(state['np_random'])
+    random.setstate(state['random'])
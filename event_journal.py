@@ -0,0 +1,205 @@
+"""
+Binary journal of in-session events
+
+The CSV keeps one row per trial; everything that happens within a trial
+(flips, sound starts, mouse crossings, escape checks, rewards, timeouts)
+goes to the journal instead. Every event is a fixed-size record
+
+    code     uint16   what happened (EVENTS)
+    trial    int32    trial index, -1 before the first trial
+    t        float64  time.perf_counter() when it was logged
+    a, b     float64  two numbers whose meaning depends on the code
+
+packed with struct.pack_into into a preallocated block of memory, so log()
+costs a few hundred nanoseconds and allocates nothing. Full blocks are
+written to <data file>_events.bin in one write; flush() writes a partial
+block, e.g. in the pause after a trial, so a crash loses at most one trial.
+
+    journal = EventJournal.for_session(data_file_path)
+    journal.start_trial(trials.thisN)
+    journal.log(SOUND_START, 1, cue_frequency)
+    ...
+    journal.close()
+
+Every launch starts with a RUN_START record. read_journal loads the file as
+a numpy structured array and trial_tables splits it into one table per
+trial, keeping the last attempt of a trial repeated after a resume. From
+the command line:
+
+    python event_journal.py data/rat7_2024-06-11_events.bin --trial 12
+"""
+
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+
+MAGIC = b'AWMEVT01'
+
+# Event codes, with the meaning of the payloads a and b
+TRIAL_START = 1
+TRIAL_END = 2       # a: 1 if correct, 0 if not, b: RT (s)
+FLIP = 3            # a: flip time (psychopy clock), b: time the flip blocked (s)
+SOUND_START = 4     # a: 1 cue, 2 choice, b: frequency (Hz)
+MOUSE_ENTER = 5     # a: 1 green box (same), 2 red box (diff), 3 yellow box
+ESCAPE_CHECK = 6    # a: 1 if escape was pressed
+REWARD = 7          # a: 1 if sent to the reward port, 0 without a port
+TIMEOUT = 8         # a: 1 no response, 2 penalty after an error, b: duration (s)
+RESPONSE_PERIOD = 9
+RUN_START = 10      # a: time.time() when the journal was opened, b: 1 if appended to an earlier run
+
+EVENTS = {TRIAL_START: 'trial_start', TRIAL_END: 'trial_end', FLIP: 'flip', SOUND_START: 'sound_start',
+          MOUSE_ENTER: 'mouse_enter', ESCAPE_CHECK: 'escape_check', REWARD: 'reward', TIMEOUT: 'timeout',
+          RESPONSE_PERIOD: 'response_period', RUN_START: 'run_start'}
+
+# Little-endian and packed, so the files read the same on every machine
+_RECORD = struct.Struct('<Hiddd')
+RECORD_DTYPE = np.dtype([('code', '<u2'), ('trial', '<i4'), ('t', '<f8'), ('a', '<f8'), ('b', '<f8')])
+assert RECORD_DTYPE.itemsize == _RECORD.size
+
+
+def journal_path(data_file_path):
+    """Path of the journal belonging to a data file"""
+    return os.path.splitext(data_file_path)[0] + '_events.bin'
+
+
+class EventJournal:
+    """Fixed-size event records in a preallocated block, written out block by block
+
+    Args:
+        path: Binary file to write. An existing journal is appended to, so a
+            resumed session continues its journal after a RUN_START record
+        capacity: Records per block
+
+    """
+
+    def __init__(self, path, capacity=4096):
+        self.path = path
+        self.capacity = capacity
+        self.block = bytearray(capacity * _RECORD.size)
+        self.n = 0  # Records in the block
+        self.written = 0  # Records in the file
+        self.trial = -1
+        self._pack = _RECORD.pack_into
+        self._size = _RECORD.size
+        self._clock = time.perf_counter
+
+        # A file without a whole header was cut off during its first write: start it again
+        new = not os.path.exists(path) or os.path.getsize(path) < len(MAGIC)
+        if not new:
+            # Drop a record that was half written when the session crashed
+            self.written = (os.path.getsize(path) - len(MAGIC)) // self._size
+            with open(path, 'r+b') as f:
+                f.truncate(len(MAGIC) + self.written * self._size)
+        self.file = open(path, 'wb' if new else 'ab')
+        if new:
+            self.file.write(MAGIC)
+        # Marks where each launch begins, so a resumed session's runs can be told apart
+        self.log(RUN_START, time.time(), 0.0 if new else 1.0)
+
+    @classmethod
+    def for_session(cls, data_file_path, **kwargs):
+        """Journal next to the data file, as <name>_events.bin"""
+        return cls(journal_path(data_file_path), **kwargs)
+
+    def start_trial(self, trial):
+        """Attribute the following events to this trial and log TRIAL_START"""
+        self.trial = trial
+        self.log(TRIAL_START)
+
+    def log(self, code, a=0.0, b=0.0):
+        """Record one event now"""
+        self._pack(self.block, self.n * self._size, code, self.trial, self._clock(), a, b)
+        self.n += 1
+        if self.n == self.capacity:
+            self.flush()
+
+    def log_at(self, code, t, a=0.0, b=0.0):
+        """Record one event with a perf_counter time taken elsewhere"""
+        self._pack(self.block, self.n * self._size, code, self.trial, t, a, b)
+        self.n += 1
+        if self.n == self.capacity:
+            self.flush()
+
+    def records(self):
+        """The records still in the block, as a structured array (a copy)"""
+        return np.frombuffer(self.block, dtype=RECORD_DTYPE, count=self.n).copy()
+
+    def flush(self):
+        """Write the records in the block to the file"""
+        if self.n:
+            self.file.write(memoryview(self.block)[:self.n * self._size])
+            self.written += self.n
+            self.n = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def read_journal(path):
+    """Load a journal as a structured array with fields code, trial, t, a and b"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an event journal")
+        data = f.read()
+    # A crash may leave a partial record at the end
+    n = len(data) // RECORD_DTYPE.itemsize
+    return np.frombuffer(data, dtype=RECORD_DTYPE, count=n)
+
+
+def trial_tables(events):
+    """Split a journal into one table per trial
+
+    A trial that was started again after a resume appears twice in the
+    journal; only its last attempt, from its last TRIAL_START on, is kept.
+
+    Args:
+        events: Structured array from read_journal
+
+    Returns:
+        dict mapping the trial index to a dict of arrays: 'event' (names),
+        'code', 't', 'dt' (s since the trial's first event), 'a' and 'b'
+
+    """
+    events = events[np.argsort(events['trial'], kind='stable')]
+    trials, starts = np.unique(events['trial'], return_index=True)
+    tables = {}
+    for trial, chunk in zip(trials, np.split(events, starts[1:])):
+        attempts = np.flatnonzero(chunk['code'] == TRIAL_START)
+        if len(attempts):
+            chunk = chunk[attempts[-1]:]
+        tables[int(trial)] = {
+            'event': np.array([EVENTS.get(int(c), str(c)) for c in chunk['code']], dtype=object),
+            'code': chunk['code'],
+            't': chunk['t'],
+            'dt': chunk['t'] - chunk['t'][0],
+            'a': chunk['a'],
+            'b': chunk['b'],
+        }
+    return tables
+
+
+def format_table(table):
+    lines = [f"{'event':<16}{'dt (ms)':>12}{'a':>14}{'b':>14}"]
+    for name, dt, a, b in zip(table['event'], table['dt'], table['a'], table['b']):
+        lines.append(f"{name:<16}{1000 * dt:>12.3f}{a:>14.6g}{b:>14.6g}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the per-trial event tables of a journal')
+    parser.add_argument('path')
+    parser.add_argument('--trial', type=int, default=None, help='Show only this trial')
+    args = parser.parse_args()
+
+    tables = trial_tables(read_journal(args.path))
+    for trial, table in tables.items():
+        if args.trial is None or trial == args.trial:
+            print(f"Trial {trial}: {len(table['code'])} events")
+            print(format_table(table) + '\n')
@@ -0,0 +1,111 @@
+"""
+Flip timing watchdog
+
+Records every win.flip() of a session into preallocated arrays and, per
+trial, counts dropped frames and the jitter of flips around the refresh
+grid. With waitBlanking=True a flip returns at the first vertical blank
+after it was called, so a flip that blocks for more than one frame period
+means the frame missed its blank (a dropped frame), whatever the task did
+before calling it.
+
+    flips = FlipRecorder(win)       # from now on win.flip() is recorded
+    for trial in trials:
+        flips.start_trial(trials.thisN)
+        ...
+        trial_data.update(flips.end_trial())
+"""
+
+import numpy as np
+from psychopy import core
+
+from event_journal import FLIP
+
+
+class FlipRecorder:
+    """Record flip times of a window and summarize them per trial
+
+    Args:
+        win: The window object. Its flip method is wrapped so every flip,
+            including those made inside helper functions, is recorded
+        frame_rate: Refresh rate in Hz. Measured from the window if None
+        capacity: Number of flips kept. Older flips are overwritten
+        max_dropped: Warn when a trial drops more frames than this
+        max_jitter: Warn when a trial's flip jitter (ms) exceeds this
+        tolerance: Fraction of a frame a flip may block beyond one period
+            before it counts as dropped
+        journal: EventJournal to log every flip to, or None
+
+    """
+
+    def __init__(self, win, frame_rate=None, capacity=100000, max_dropped=2, max_jitter=2.0, tolerance=0.2,
+                 journal=None):
+        self.win = win
+        if frame_rate is None:
+            frame_rate = win.getActualFrameRate() or 60.0
+        self.period = 1.0 / frame_rate
+        self.capacity = capacity
+        self.max_dropped = max_dropped
+        self.max_jitter = max_jitter
+        self.tolerance = tolerance
+        self.journal = journal
+
+        # Preallocated flip log
+        self.call_times = np.zeros(capacity)
+        self.flip_times = np.zeros(capacity)
+        self.done_times = np.zeros(capacity)
+        self.trials = np.full(capacity, -1, dtype='int32')
+        self.n = 0
+
+        self.trial = -1
+        self._trial_start = 0
+        self._flip = win.flip
+        win.flip = self.flip
+
+    def flip(self, *args, **kwargs):
+        """Flip the window and record when it was requested and when it happened"""
+        call_time = core.getTime()
+        flip_time = self._flip(*args, **kwargs)
+        done_time = core.getTime()
+
+        ii = self.n % self.capacity
+        self.call_times[ii] = call_time
+        self.flip_times[ii] = flip_time if flip_time is not None else done_time
+        self.done_times[ii] = done_time
+        self.trials[ii] = self.trial
+        self.n += 1
+        if self.journal is not None:
+            self.journal.log(FLIP, self.flip_times[ii], done_time - call_time)
+        return flip_time
+
+    def start_trial(self, trial):
+        """Attribute the following flips to this trial"""
+        self.trial = trial
+        self._trial_start = self.n
+
+    def end_trial(self, warn=True):
+        """Summarize the flips of the current trial
+
+        Returns:
+            dict with the number of flips, dropped frames and inter-flip
+            jitter (ms), ready to add to the trial data
+
+        """
+        start = max(self._trial_start, self.n - self.capacity)
+        idx = np.arange(start, self.n) % self.capacity
+
+        blocked = self.done_times[idx] - self.call_times[idx]
+        dropped = int(np.maximum(np.floor(blocked / self.period - self.tolerance), 0).sum())
+
+        # Distance of every inter-flip interval from a whole number of frames
+        intervals = np.diff(self.flip_times[idx])
+        residual = intervals - np.round(intervals / self.period) * self.period
+        jitter = float(np.sqrt(np.mean(residual ** 2)) * 1000) if len(intervals) else 0.0
+
+        if warn and (dropped > self.max_dropped or jitter > self.max_jitter):
+            print(f"WARNING: trial {self.trial} dropped {dropped} frames, flip jitter {jitter:.2f} ms")
+
+        return {'Flips': len(idx), 'Dropped Frames': dropped, 'Flip Jitter (ms)': jitter}
+
+    def detach(self):
+        """Give the window its own flip back"""
+        self.win.flip = self._flip
@@ -1,3 +1,3 @@
-import serial
-port = serial.Serial("COM4",115200) # serial port and baud rate for dell xps laptop
-port.write(str.encode('r200'))  
\ No newline at end of file
+from reward_daemon import open_reward_port
+port = open_reward_port("COM4",115200) # serial port and baud rate for dell xps laptop, shared through reward_daemon.py if it runs
+port.write(str.encode('r200'))
\ No newline at end of file
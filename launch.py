@@ -0,0 +1,64 @@
+"""
+Non-interactive launch of the task shells
+
+Every shell opens a gui.DlgFromDict for the participant name, which also
+means importing a GUI toolkit before the first trial. With a participant on
+the command line or a profile file, launch_settings fills the same dict
+without any dialog, so an unattended session starts straight away:
+
+    python Task_AudWM-Shell_NewTiming.py --participant rat7
+    python Task_AudWM-Shell_NewTiming.py --profile profiles/rat7.json
+    python Task_AudWM-Shell_NewTiming.py --participant rat7 --resume
+
+A profile is a JSON dict of the dialog fields, e.g.
+
+    {"Participant Name": "rat7"}
+
+Without arguments the dialog is shown as before.
+"""
+
+import argparse
+import json
+
+
+def parse_launch_args(argv=None):
+    """--participant and --profile from the command line; other arguments are left alone"""
+    parser = argparse.ArgumentParser(description='Launch a session without the setup dialog')
+    parser.add_argument('--participant', help='Participant name')
+    parser.add_argument('--profile', help='JSON file with the setup fields')
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the participant's last session if it crashed (sets info['Resume'])")
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def load_profile(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def launch_settings(info, title='Experiment Setup', argv=None):
+    """Fill info from the command line or a profile, or else from the dialog
+
+    Args:
+        info: dict of setup fields with their defaults, as for gui.DlgFromDict
+        title: Title of the dialog
+        argv: Arguments to parse instead of sys.argv
+
+    Returns:
+        True if info was filled, False if the dialog was cancelled
+
+    """
+    args = parse_launch_args(argv)
+    if args.resume and 'Resume' in info:
+        info['Resume'] = True
+    settings = load_profile(args.profile) if args.profile else {}
+    if args.participant is not None:
+        settings['Participant Name'] = args.participant
+    if settings:
+        info.update(settings)
+        return True
+
+    from psychopy import gui
+    dlg = gui.DlgFromDict(dictionary=info, title=title)
+    return dlg.OK
@@ -0,0 +1,283 @@
+"""
+Incremental analysis of sessions while they run
+
+SessionTail follows one session CSV from the byte offset it has read up to
+and parses only the complete rows added since, updating per-condition
+accuracy, RT statistics and the 10/20/50-trial moving proportion correct
+(performance.PerformanceTracker) without re-reading the file. It works with
+both ways the shells write their data:
+
+    - append-only files (checkpoint.TrialLog): new rows are simply read
+    - save_data rewriting the whole file after every trial: the rewrite
+      repeats the rows already read, so the bytes up to the offset are
+      unchanged and only the rows after it are new
+
+Before reading on, the last bytes before the offset are compared with what
+was read there; if they differ, or the file stays shorter than the offset,
+the file was replaced or cut back (e.g. by a resumed session) and is read
+again from the start. A file caught half way through a rewrite is shorter
+than the offset only briefly and is just read on the next poll.
+
+SessionWatcher does this for every CSV in the data folder that changed
+recently. From the command line:
+
+    python live_analysis.py data --interval 2
+"""
+
+import argparse
+import csv
+import glob
+import io
+import math
+import os
+import time
+
+from performance import PerformanceTracker
+
+FINGERPRINT_BYTES = 64
+
+
+class RunningStats:
+    """Count, mean, SD, min and max updated one value at a time (Welford)"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def push(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def sd(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else math.nan
+
+
+class ConditionStats:
+    """Trials, correct responses and RTs of one (cue, choice, coherence) condition"""
+
+    def __init__(self):
+        self.n = 0
+        self.correct = 0
+        self.no_response = 0
+        self.rt = RunningStats()  # Trials with a response only
+
+    @property
+    def accuracy(self):
+        """Proportion correct, counting trials without a response as not correct
+
+        The same rule as the moving windows (performance.PerformanceTracker)
+        and AudWManalysis.m, so both show the same proportion for the same trials.
+        """
+        return self.correct / self.n if self.n else math.nan
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class SessionTail:
+    """Follow one session CSV and keep its statistics up to date
+
+    Args:
+        path: Session CSV
+        windows: Window sizes (in trials) of the moving proportion correct
+
+    """
+
+    def __init__(self, path, windows=(10, 20, 50)):
+        self.path = path
+        self.windows = tuple(windows)
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        """Forget everything read so far, so the next poll starts from the top of the file"""
+        self.offset = 0
+        self.fingerprint = b''
+        self.fieldnames = None
+        self.short_size = None  # File size when it was last seen shorter than the offset
+        self.n_trials = 0
+        self.last_trial = None
+        self.conditions = {}
+        self.rt = RunningStats()
+        self.performance = PerformanceTracker(self.windows)
+
+    def poll(self):
+        """Read the rows added since the last poll
+
+        Returns:
+            Number of new trials
+
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0  # Between a delete and a rewrite
+
+        if size < self.offset:
+            # Being rewritten right now, or cut back: read from the start if it stays short
+            if self.short_size != size:
+                self.short_size = size
+                return 0
+            self._restart()
+        self.short_size = None
+
+        start = self.offset - len(self.fingerprint)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            data = f.read(size - start)
+        if data[:len(self.fingerprint)] != self.fingerprint:
+            self._restart()
+            with open(self.path, 'rb') as f:
+                data = f.read(size)
+        else:
+            data = data[len(self.fingerprint):]
+
+        # Only complete lines; a partial last row is read again next time
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+        chunk = data[:end]
+        lines = io.StringIO(chunk.decode('utf-8', errors='replace'), newline='')
+        if self.fieldnames is None:
+            self.fieldnames = next(csv.reader(lines))
+        new_trials = 0
+        for row in csv.DictReader(lines, fieldnames=self.fieldnames):
+            new_trials += self._add(row)
+
+        self.offset += end
+        self.fingerprint = (self.fingerprint + chunk)[-FINGERPRINT_BYTES:]
+        return new_trials
+
+    def _restart(self):
+        self.reset()
+        self.resets += 1
+
+    def _add(self, row):
+        """Update the statistics with one row. Returns 1 if it was a trial, 0 if skipped"""
+        cue = _float(row.get('Cue Frequency'))
+        choice = _float(row.get('Choice Frequency'))
+        coherence = _float(row.get('Coherence'))
+        if math.isnan(cue) or math.isnan(choice):
+            return 0
+        response = row.get('Response')
+        rt = _float(row.get('RT'))
+
+        # Correct criteria as in AudWManalysis.m
+        responded = response in ('same', 'diff')
+        correct = responded and response == ('same' if cue == choice else 'diff')
+
+        condition = self.conditions.setdefault((cue, choice, coherence), ConditionStats())
+        condition.n += 1
+        condition.correct += correct
+        condition.no_response += not responded
+        if responded and not math.isnan(rt):
+            condition.rt.push(rt)
+            self.rt.push(rt)
+        self.performance.update(cue, choice, coherence, correct)
+        self.n_trials += 1
+        self.last_trial = row.get('Trial Number')
+        return 1
+
+    def rows(self):
+        """Per-condition summary, ready to be written with csv.DictWriter"""
+        rows = []
+        for (cue, choice, coherence), stats in sorted(self.conditions.items()):
+            rows.append({'Session': os.path.splitext(os.path.basename(self.path))[0],
+                         'Cue Frequency': cue, 'Choice Frequency': choice, 'Coherence': coherence,
+                         'N Trials': stats.n, 'N Correct': stats.correct, 'No Response': stats.no_response,
+                         'Accuracy': stats.accuracy, 'RT Mean': stats.rt.mean if stats.rt.n else math.nan,
+                         'RT SD': stats.rt.sd})
+        return rows
+
+    def summary(self):
+        """Multi-line status of the session for the console"""
+        name = os.path.basename(self.path)
+        rt = f"RT {self.rt.mean:.2f}+-{self.rt.sd:.2f} s" if self.rt.n else 'RT --'
+        lines = [f"{name}: trial {self.last_trial}, {self.n_trials} trials, {rt}",
+                 f"  {self.performance.status_line()}"]
+        for row in self.rows():
+            lines.append(f"  {row['Cue Frequency']:g}->{row['Choice Frequency']:g} coh {row['Coherence']:g}: "
+                         f"{row['N Correct']}/{row['N Trials']} correct "
+                         f"({row['Accuracy']:.2f}), {row['No Response']} no response, "
+                         f"RT {row['RT Mean']:.2f}+-{row['RT SD']:.2f} s")
+        return '\n'.join(lines)
+
+
+class SessionWatcher:
+    """Follow every session CSV in a folder that is still being written
+
+    Args:
+        data_dir: Folder the shells write to
+        active_within: Only follow files modified within this many seconds
+        windows: Window sizes (in trials) of the moving proportion correct
+
+    """
+
+    def __init__(self, data_dir='data', active_within=600, windows=(10, 20, 50)):
+        self.data_dir = data_dir
+        self.active_within = active_within
+        self.windows = windows
+        self.sessions = {}
+
+    def poll(self):
+        """Pick up new session files and read the new rows of every followed file
+
+        Returns:
+            dict mapping the path of every session with new trials to their number
+
+        """
+        now = time.time()
+        for path in glob.glob(os.path.join(self.data_dir, '*.csv')):
+            if path not in self.sessions:
+                try:
+                    recent = now - os.path.getmtime(path) < self.active_within
+                except OSError:
+                    continue
+                if recent:
+                    self.sessions[path] = SessionTail(path, self.windows)
+
+        updated = {}
+        for path, tail in self.sessions.items():
+            n = tail.poll()
+            if n:
+                updated[path] = n
+        return updated
+
+    def watch(self, interval=2.0, callback=None):
+        """Poll until interrupted, calling callback(watcher, updated) after polls that found new trials"""
+        try:
+            while True:
+                updated = self.poll()
+                if updated and callback is not None:
+                    callback(self, updated)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Follow the sessions being written to a data folder')
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls')
+    parser.add_argument('--active-within', type=float, default=600,
+                        help='Follow files modified within this many seconds')
+    args = parser.parse_args()
+
+    def show(watcher, updated):
+        for path in updated:
+            print(watcher.sessions[path].summary() + '\n')
+
+    print(f"Watching {args.data_dir} (Ctrl+C to stop)")
+    SessionWatcher(args.data_dir, args.active_within).watch(args.interval, show)
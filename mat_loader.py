@@ -0,0 +1,146 @@
+"""
+Lazy, cached loading of the RibbonVolumeWorkspace .mat files
+
+The workspaces saved by the histology script hold every variable of the
+MATLAB session. WorkspaceLoader reads only the variable headers to list
+what is in the file, seeks straight to a variable to load it, converts
+MATLAB structs (binData, meanVolumes, ...) into nested dicts of NumPy
+arrays, and caches every converted variable in '<file>.cache/' so the next
+load is a single unpickle. The cache is dropped when the .mat file changes.
+
+    ws = WorkspaceLoader('RibbonVolumeWorkspaceWithSpecificEarsAndBinnedFreq.mat')
+    ws.variables()                 # names, classes and sizes, nothing loaded
+    binData = ws['binData']        # {'M_long': {'low': array, ...}, ...}
+"""
+
+import json
+import os
+import pickle
+
+import numpy as np
+from scipy.io.matlab import mat_struct
+
+try:
+    from scipy.io.matlab._mio5 import MatFile5Reader
+except ImportError:  # scipy < 1.8
+    from scipy.io.matlab.mio5 import MatFile5Reader
+
+# MATLAB class codes of the variable headers, see scipy.io.matlab._mio5_params
+MAT_CLASSES = {1: 'cell', 2: 'struct', 3: 'object', 4: 'char', 5: 'sparse', 6: 'double', 7: 'single',
+               8: 'int8', 9: 'uint8', 10: 'int16', 11: 'uint16', 12: 'int32', 13: 'uint32',
+               14: 'int64', 15: 'uint64', 16: 'function', 17: 'opaque'}
+
+
+def to_python(value):
+    """Convert what scipy reads from a .mat file into dicts, lists and NumPy arrays
+
+    Structs become dicts (struct arrays become lists of dicts), cell arrays
+    become lists and numeric arrays are left as they are.
+    """
+    if isinstance(value, mat_struct):
+        return {name: to_python(getattr(value, name)) for name in value._fieldnames}
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return [to_python(v) for v in value.ravel()]
+    return value
+
+
+class WorkspaceLoader:
+    """Per-variable access to a MATLAB v5 workspace file
+
+    Args:
+        filename: Path to the .mat file
+        cache_dir: Where converted variables are cached. Defaults to '<filename>.cache'
+
+    """
+
+    def __init__(self, filename, cache_dir=None):
+        self.filename = filename
+        self.cache_dir = cache_dir if cache_dir is not None else filename + '.cache'
+        self._index = None
+
+    def _stamp(self):
+        stat = os.stat(self.filename)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _reader(self, fh):
+        reader = MatFile5Reader(fh, squeeze_me=True, struct_as_record=False, chars_as_strings=True)
+        reader.initialize_read()
+        return reader
+
+    def _build_index(self):
+        """Offset, class and size of every named variable, from the headers only"""
+        index = {}
+        with open(self.filename, 'rb') as fh:
+            reader = self._reader(fh)
+            fh.seek(128)  # past the file header
+            while not reader.end_of_stream():
+                start = fh.tell()
+                hdr, next_pos = reader.read_var_header()
+                name = hdr.name.decode('latin1') if hdr.name else ''
+                # Unnamed entries are MATLAB objects (strings, tables) and the
+                # function workspace, which scipy cannot convert
+                if name and hdr.mclass != 17:
+                    index[name] = {'offset': start, 'class': MAT_CLASSES.get(hdr.mclass, str(hdr.mclass)),
+                                   'dims': [int(d) for d in hdr.dims] if hdr.dims is not None else None}
+                fh.seek(next_pos)
+        return index
+
+    @property
+    def index(self):
+        """Variable index, read from the cache when the .mat file is unchanged"""
+        if self._index is None:
+            stamp = self._stamp()
+            index_file = os.path.join(self.cache_dir, 'index.json')
+            try:
+                with open(index_file) as f:
+                    cached = json.load(f)
+                if cached['stamp'] != stamp:
+                    raise ValueError('stale cache')
+                self._index = cached['variables']
+            except (OSError, ValueError, KeyError):
+                # Anything cached belongs to an older version of the file
+                if os.path.isdir(self.cache_dir):
+                    for f in os.listdir(self.cache_dir):
+                        os.remove(os.path.join(self.cache_dir, f))
+                else:
+                    os.makedirs(self.cache_dir)
+                self._index = self._build_index()
+                with open(index_file, 'w') as f:
+                    json.dump({'stamp': stamp, 'variables': self._index}, f)
+        return self._index
+
+    def variables(self):
+        """dict of variable name to its MATLAB class and size, without loading anything"""
+        return {name: {'class': v['class'], 'dims': v['dims']} for name, v in self.index.items()}
+
+    def load(self, name):
+        """Load one variable, converted with to_python"""
+        if name not in self.index:
+            raise KeyError(f"'{name}' is not a variable of {self.filename}")
+
+        cache_file = os.path.join(self.cache_dir, name + '.pkl')
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+
+        with open(self.filename, 'rb') as fh:
+            reader = self._reader(fh)
+            fh.seek(self.index[name]['offset'])
+            hdr, _ = reader.read_var_header()
+            value = to_python(reader.read_var_array(hdr, process=True))
+
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+        return value
+
+    def load_many(self, names):
+        """dict of the requested variables"""
+        return {name: self.load(name) for name in names}
+
+    def __getitem__(self, name):
+        return self.load(name)
+
+    def __contains__(self, name):
+        return name in self.index
@@ -0,0 +1,97 @@
+"""
+Online rolling performance for the running task
+
+Keeps the 10/20/50-trial moving proportion correct (as plotted by
+AudWManalysis.m) per (cue, choice) frequency pair and per coherence, updated
+in constant time after every trial, so the values can be shown and logged
+without re-reading the CSV.
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed-size ring of the last trial outcomes with running window sums
+
+    Args:
+        windows: Window sizes (in trials) to maintain
+
+    """
+
+    def __init__(self, windows=(10, 20, 50)):
+        self.windows = tuple(windows)
+        self.size = max(self.windows)
+        self.values = np.zeros(self.size)
+        self.sums = np.zeros(len(self.windows))
+        self.n = 0
+
+    def push(self, value):
+        """Add one outcome, updating every window sum in O(1)"""
+        for ii, w in enumerate(self.windows):
+            if self.n >= w:
+                self.sums[ii] -= self.values[(self.n - w) % self.size]
+            self.sums[ii] += value
+        self.values[self.n % self.size] = value
+        self.n += 1
+
+    def means(self):
+        """Mean of each window. Windows that are not yet full use the trials so far"""
+        counts = np.minimum(self.n, self.windows)
+        return np.divide(self.sums, counts, out=np.full(len(self.windows), np.nan), where=counts > 0)
+
+
+class PerformanceTracker:
+    """Moving proportion correct per (cue, choice) pair and per coherence
+
+    Trials without a response count as not correct, as in AudWManalysis.m.
+
+    Args:
+        windows: Window sizes (in trials)
+
+    """
+
+    def __init__(self, windows=(10, 20, 50)):
+        self.windows = tuple(windows)
+        self.overall = RingBuffer(self.windows)
+        self.by_pair = {}
+        self.by_coherence = {}
+
+    def update(self, cue_frequency, choice_frequency, coherence, correct):
+        """Record the outcome of one trial"""
+        value = float(bool(correct))
+        self.overall.push(value)
+        pair = (cue_frequency, choice_frequency)
+        if pair not in self.by_pair:
+            self.by_pair[pair] = RingBuffer(self.windows)
+        self.by_pair[pair].push(value)
+        if coherence not in self.by_coherence:
+            self.by_coherence[coherence] = RingBuffer(self.windows)
+        self.by_coherence[coherence].push(value)
+
+    def log_fields(self, cue_frequency, choice_frequency, coherence):
+        """Current moving proportions for one condition, to add to the trial data
+
+        Returns:
+            dict such as {'PC10 Pair': 0.8, ..., 'PC50 Coherence': 0.7}
+
+        """
+        fields = {}
+        for label, ring in (('All', self.overall),
+                            ('Pair', self.by_pair.get((cue_frequency, choice_frequency))),
+                            ('Coherence', self.by_coherence.get(coherence))):
+            means = ring.means() if ring is not None else np.full(len(self.windows), np.nan)
+            for w, m in zip(self.windows, means):
+                fields[f'PC{w} {label}'] = m
+        return fields
+
+    def status_line(self):
+        """One-line summary of the current performance for the experimenter console"""
+        def fmt(ring):
+            return '/'.join('--' if np.isnan(m) else f'{m:.2f}' for m in ring.means())
+
+        parts = [f"n={self.overall.n} all {fmt(self.overall)}"]
+        for (cue, choice), ring in sorted(self.by_pair.items()):
+            parts.append(f"{cue:g}->{choice:g} {fmt(ring)}")
+        for coherence, ring in sorted(self.by_coherence.items()):
+            parts.append(f"coh {coherence:g} {fmt(ring)}")
+        return ' | '.join(parts) + f"  (PC over last {'/'.join(str(w) for w in self.windows)} trials)"
@@ -0,0 +1,155 @@
+"""
+Opt-in profiling of named trial phases
+
+Switched on with the environment variable AUDWM_PROFILING=1 or the
+--profiling flag, and free otherwise (phase() then returns a no-op context).
+Each named phase gets its own cProfile.Profile that is enabled only while the
+phase runs, so the statistics of all trials add up per phase. tracemalloc
+runs for the whole session; every phase records its net and peak memory,
+and every snapshot_every-th call of a phase also compares snapshots before
+and after it to find the lines that allocate.
+
+At the end dump() writes, into <data file>_profile/:
+    <phase>.prof      pstats file per phase (python -m pstats, snakeviz, ...)
+    all_phases.prof   the phases combined
+    allocations.txt   time and memory per phase and the top allocation sites
+
+    profiler = PhaseProfiler.from_environment(data_file_path)
+    with profiler.phase('synthesis'):
+        cue_tone_sequence = generate_tone_sequence(...)
+    ...
+    profiler.dump()
+
+Phases must not be nested.
+"""
+
+import contextlib
+import cProfile
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+
+def profiling_requested(argv=None):
+    """True if AUDWM_PROFILING is set (and not 0) or --profiling is on the command line"""
+    argv = sys.argv if argv is None else argv
+    return os.environ.get('AUDWM_PROFILING', '0') not in ('', '0') or '--profiling' in argv
+
+
+# Leave the profiler's own bookkeeping out of the allocation sites
+_SELF_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                 tracemalloc.Filter(False, contextlib.__file__)]
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_SELF_FILTERS)
+
+
+class _PhaseStats:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.seconds = 0.0
+        self.net_bytes = 0
+        self.peak_bytes = 0
+        self.sites = {}  # (file, line) -> [bytes, count] from sampled snapshot diffs
+
+
+class PhaseProfiler:
+    """cProfile and tracemalloc capture per named phase
+
+    Args:
+        enabled: Whether to profile at all
+        out_dir: Folder for the results
+        top: Number of allocation sites in the report
+        snapshot_every: Compare tracemalloc snapshots on every this-many-th call of a phase
+        frames: Traceback depth kept by tracemalloc
+
+    """
+
+    def __init__(self, enabled=False, out_dir='profile', top=20, snapshot_every=50, frames=1):
+        self.enabled = enabled
+        self.out_dir = out_dir
+        self.top = top
+        self.snapshot_every = snapshot_every
+        self.phases = {}
+        if enabled:
+            tracemalloc.start(frames)
+
+    @classmethod
+    def from_environment(cls, data_file_path, **kwargs):
+        """Profiler that is enabled if profiling_requested(), writing next to the data file"""
+        return cls(profiling_requested(), os.path.splitext(data_file_path)[0] + '_profile', **kwargs)
+
+    def phase(self, name):
+        """Context manager profiling one run of the named phase"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._phase(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        stats = self.phases.setdefault(name, _PhaseStats())
+        sample = stats.calls % self.snapshot_every == 0
+        before = _snapshot() if sample else None
+        tracemalloc.reset_peak()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        stats.profile.enable()
+        try:
+            yield
+        finally:
+            stats.profile.disable()
+            stats.seconds += time.perf_counter() - t0
+            current, peak = tracemalloc.get_traced_memory()
+            stats.net_bytes += current - start_bytes
+            stats.peak_bytes = max(stats.peak_bytes, peak - start_bytes)
+            stats.calls += 1
+            if sample:
+                for diff in _snapshot().compare_to(before, 'lineno'):
+                    if diff.size_diff > 0:
+                        frame = diff.traceback[0]
+                        site = stats.sites.setdefault((frame.filename, frame.lineno), [0, 0])
+                        site[0] += diff.size_diff
+                        site[1] += diff.count_diff
+
+    def report(self):
+        """Text report of time and memory per phase and the top allocation sites"""
+        lines = [f"{'phase':<20}{'calls':>8}{'total s':>10}{'mean ms':>10}{'net KiB/call':>14}{'peak KiB':>10}"]
+        for name, stats in self.phases.items():
+            calls = max(stats.calls, 1)
+            lines.append(f"{name:<20}{stats.calls:>8}{stats.seconds:>10.2f}{1000 * stats.seconds / calls:>10.2f}"
+                         f"{stats.net_bytes / calls / 1024:>14.1f}{stats.peak_bytes / 1024:>10.1f}")
+
+        for name, stats in self.phases.items():
+            lines.append(f"\nTop allocations in '{name}' (sampled every {self.snapshot_every} calls):")
+            ranked = sorted(stats.sites.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+            for (filename, lineno), (size, count) in ranked:
+                lines.append(f"  {size / 1024:10.1f} KiB {count:8d} blocks  {filename}:{lineno}")
+
+        if tracemalloc.is_tracing():
+            lines.append("\nTop allocations still held at the end of the session:")
+            for stat in _snapshot().statistics('lineno')[:self.top]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+        return '\n'.join(lines)
+
+    def dump(self):
+        """Write the pstats files and the allocation report. Returns the folder, or None if disabled"""
+        if not self.enabled or not self.phases:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        combined = None
+        for name, stats in self.phases.items():
+            stats.profile.dump_stats(os.path.join(self.out_dir, f"{name.replace(' ', '_')}.prof"))
+            if combined is None:
+                combined = pstats.Stats(stats.profile)
+            else:
+                combined.add(stats.profile)
+        combined.dump_stats(os.path.join(self.out_dir, 'all_phases.prof'))
+        with open(os.path.join(self.out_dir, 'allocations.txt'), 'w') as f:
+            f.write(self.report() + '\n')
+        tracemalloc.stop()
+        return self.out_dir
@@ -0,0 +1,306 @@
+"""
+Batched psychometric-function fitting for the aud WM task
+
+Every (participant, session, cue frequency, choice frequency) group is
+reduced to per-coherence trial counts, padded into (n_groups, n_levels)
+arrays and fit all at once. The fit is a coarse-to-fine grid search over
+(threshold, slope, lapse) whose likelihood is evaluated for a whole chunk of
+groups in one vectorized step, so thousands of curves fit in seconds.
+
+From the command line:
+
+    python psychometric.py data --kind weibull --boot 1000 --jobs 4
+"""
+
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Default search grids, per function kind
+GRIDS = {
+    'logistic': {'thresholds': np.linspace(0.0, 1.5, 16), 'slopes': np.geomspace(0.5, 100, 12)},
+    'weibull': {'thresholds': np.linspace(0.05, 1.5, 15), 'slopes': np.geomspace(0.5, 20, 12)},
+}
+
+GROUP_FIELDS = ('Participant', 'Session', 'Cue Frequency', 'Choice Frequency')
+
+
+def load_session(path):
+    """Read one session CSV as written by the task shells
+
+    Args:
+        path: Path to the CSV
+
+    Returns:
+        dict of numpy arrays, one per column, plus 'Session' (the file name
+        without extension) and 'Correct' (1, 0, or NaN when there was no
+        response)
+
+    """
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    session = os.path.splitext(os.path.basename(path))[0]
+    cue = np.array([float(r['Cue Frequency']) for r in rows])
+    choice = np.array([float(r['Choice Frequency']) for r in rows])
+    response = np.array([r['Response'] for r in rows], dtype=object)
+
+    # Correct criteria as in AudWManalysis.m
+    correct_response = np.where(cue == choice, 'same', 'diff')
+    correct = np.where(response == correct_response, 1.0, 0.0)
+    correct[(response != 'same') & (response != 'diff')] = np.nan
+
+    return {
+        'Participant': np.array([r['Participant'] for r in rows], dtype=object),
+        'Session': np.full(len(rows), session, dtype=object),
+        'Cue Frequency': cue,
+        'Choice Frequency': choice,
+        'Coherence': np.array([float(r['Coherence']) for r in rows]),
+        'RT': np.array([float(r['RT']) for r in rows]),
+        'Response': response,
+        'Correct': correct,
+    }
+
+
+def load_sessions(data_dir):
+    """Concatenate every session CSV found in data_dir (see load_session)"""
+    sessions = [load_session(f) for f in sorted(glob.glob(os.path.join(data_dir, '*.csv')))]
+    sessions = [s for s in sessions if len(s['Correct'])]
+    if not sessions:
+        raise FileNotFoundError(f"No session CSVs with trials in {data_dir}")
+    return {key: np.concatenate([s[key] for s in sessions]) for key in sessions[0]}
+
+
+def group_counts(trials, by=GROUP_FIELDS):
+    """Count trials and correct responses per coherence level for each group
+
+    Args:
+        trials: dict of arrays as returned by load_sessions
+        by: Fields defining a group
+
+    Returns:
+        keys: list of tuples, one per group
+        levels: (n_groups, n_levels) coherence levels, padded with NaN
+        n: (n_groups, n_levels) number of trials, 0 where padded
+        k: (n_groups, n_levels) number of correct trials, 0 where padded
+
+    """
+    valid = ~np.isnan(trials['Correct'])
+    columns = [trials[f][valid] for f in by]
+    coherence = trials['Coherence'][valid]
+    correct = trials['Correct'][valid]
+
+    # One integer id per group and per (group, level) cell
+    _, group_idx = np.unique(np.array([c.astype(str) for c in columns]).T, axis=0, return_inverse=True)
+    group_idx = group_idx.ravel()
+    cells, cell_idx = np.unique(np.column_stack((group_idx, coherence)), axis=0, return_inverse=True)
+    cell_idx = cell_idx.ravel()
+    cell_n = np.bincount(cell_idx)
+    cell_k = np.bincount(cell_idx, weights=correct)
+
+    # Position of every cell within its group's row
+    cell_group = cells[:, 0].astype(int)
+    first = np.searchsorted(cell_group, cell_group)
+    col = np.arange(len(cells)) - first
+
+    n_groups = cell_group.max() + 1
+    n_levels = col.max() + 1
+    levels = np.full((n_groups, n_levels), np.nan)
+    n = np.zeros((n_groups, n_levels))
+    k = np.zeros((n_groups, n_levels))
+    levels[cell_group, col] = cells[:, 1]
+    n[cell_group, col] = cell_n
+    k[cell_group, col] = cell_k
+
+    first_trial = np.unique(group_idx, return_index=True)[1]
+    keys = [tuple(c[i] for c in columns) for i in first_trial]
+    return keys, levels, n, k
+
+
+def psychometric(x, threshold, slope, lapse, kind='logistic', guess=0.5):
+    """Probability correct for coherence x
+
+    Args:
+        x: Coherence
+        threshold: Midpoint (logistic) or scale (weibull) of the function
+        slope: Slope (logistic) or shape (weibull) of the function
+        lapse: Lapse rate
+        kind: 'logistic' or 'weibull'
+        guess: Chance performance (0.5 for same/diff)
+
+    """
+    if kind == 'logistic':
+        f = 1 / (1 + np.exp(-slope * (x - threshold)))
+    elif kind == 'weibull':
+        f = 1 - np.exp(-(x / threshold) ** slope)
+    else:
+        raise ValueError(f"Unknown psychometric function '{kind}'")
+    return guess + (1 - guess - lapse) * f
+
+
+def _loglik(levels, n, k, thr, slp, lps, kind, guess):
+    """Binomial log likelihood, levels/n/k are (G, L, 1) and parameters (G, 1, P)"""
+    p = np.clip(psychometric(levels, thr, slp, lps, kind, guess), 1e-9, 1 - 1e-9)
+    return (k * np.log(p) + (n - k) * np.log1p(-p)).sum(axis=1)
+
+
+def _fit_block(levels, n, k, kind, guess, thresholds, slopes, lapses, refine):
+    """Fit one block of groups, levels/n/k are (G, L)"""
+    # Fewer than two tested levels cannot pin down a threshold and a slope
+    degenerate = (n > 0).sum(axis=1) < 2
+    levels = np.where(n > 0, np.nan_to_num(levels, nan=1.0), 1.0)[:, :, None]
+    n = n[:, :, None]
+    k = k[:, :, None]
+    rows = np.arange(levels.shape[0])
+
+    # Coarse grid shared by all groups
+    thr, slp, lps = (g.ravel() for g in np.meshgrid(thresholds, slopes, lapses, indexing='ij'))
+    ll = _loglik(levels, n, k, thr[None, None], slp[None, None], lps[None, None], kind, guess)
+    idx = ll.argmax(axis=1)
+    best = np.column_stack((thr[idx], slp[idx], lps[idx]))
+    best_ll = ll[rows, idx]
+
+    # Zoom in around each group's best point, staying inside the coarse grid.
+    # Slopes are refined on a log scale
+    d_thr = np.diff(thresholds).mean() if len(thresholds) > 1 else 0.0
+    d_slp = np.diff(np.log(slopes)).mean() if len(slopes) > 1 else 0.0
+    d_lps = np.diff(lapses).mean() if len(lapses) > 1 else 0.0
+    offsets = np.linspace(-1, 1, 5)
+    o_thr, o_slp, o_lps = (g.ravel() for g in np.meshgrid(offsets, offsets, offsets, indexing='ij'))
+    for _ in range(refine):
+        thr = np.clip(best[:, [0]] + o_thr * d_thr, thresholds.min(), thresholds.max())
+        slp = np.clip(best[:, [1]] * np.exp(o_slp * d_slp), slopes.min(), slopes.max())
+        lps = np.clip(best[:, [2]] + o_lps * d_lps, lapses.min(), lapses.max())
+        ll = _loglik(levels, n, k, thr[:, None], slp[:, None], lps[:, None], kind, guess)
+        idx = ll.argmax(axis=1)
+        best = np.column_stack((thr[rows, idx], slp[rows, idx], lps[rows, idx]))
+        best_ll = ll[rows, idx]
+        d_thr, d_slp, d_lps = d_thr / 2, d_slp / 2, d_lps / 2
+
+    fits = np.column_stack((best, best_ll))
+    fits[degenerate] = np.nan
+    return fits
+
+
+def _fit_chunk(levels, n, k, kind, guess, thresholds, slopes, lapses, refine, max_elements):
+    """Fit groups in blocks small enough to keep the likelihood array under max_elements"""
+    n_params = max(len(thresholds) * len(slopes) * len(lapses), 125)
+    step = max(1, int(max_elements // (levels.shape[1] * n_params)))
+    return np.concatenate([_fit_block(levels[s:s + step], n[s:s + step], k[s:s + step], kind, guess,
+                                      thresholds, slopes, lapses, refine)
+                           for s in range(0, len(levels), step)])
+
+
+def fit_psychometric(levels, n, k, kind='logistic', guess=0.5, lapse_max=0.1, thresholds=None,
+                     slopes=None, n_lapses=4, refine=8, n_jobs=1, max_elements=2e7):
+    """Maximum likelihood fit of a psychometric function to every group at once
+
+    Args:
+        levels, n, k: Padded arrays as returned by group_counts
+        kind: 'logistic' or 'weibull'
+        guess: Chance performance (0.5 for same/diff)
+        lapse_max: Largest lapse rate considered
+        thresholds, slopes: Coarse search grids. Defaults depend on kind (see GRIDS)
+        n_lapses: Number of lapse rates in the coarse grid
+        refine: Number of coarse-to-fine refinement rounds
+        n_jobs: Number of worker processes. Groups are split evenly across them
+        max_elements: Upper bound on the size of the likelihood array held at once
+
+    Returns:
+        (n_groups, 4) array with threshold, slope, lapse and log likelihood.
+        Fits stay within the threshold and slope grids; groups with fewer
+        than two tested levels are NaN
+
+    """
+    thresholds = GRIDS[kind]['thresholds'] if thresholds is None else np.asarray(thresholds)
+    slopes = GRIDS[kind]['slopes'] if slopes is None else np.asarray(slopes)
+    lapses = np.linspace(0, lapse_max, n_lapses)
+    args = (kind, guess, thresholds, slopes, lapses, refine, max_elements)
+
+    if n_jobs == 1 or len(levels) < 2 * n_jobs:
+        return _fit_chunk(levels, n, k, *args)
+
+    splits = np.array_split(np.arange(len(levels)), n_jobs)
+    with ProcessPoolExecutor(n_jobs) as pool:
+        futures = [pool.submit(_fit_chunk, levels[s], n[s], k[s], *args) for s in splits]
+        return np.concatenate([f.result() for f in futures])
+
+
+def bootstrap_ci(levels, n, k, n_boot=1000, ci=95, seed=None, **fit_kwargs):
+    """Nonparametric bootstrap confidence intervals for every group
+
+    Each bootstrap replicate redraws the number correct at every level from a
+    binomial with the observed proportion. All replicates of all groups are
+    stacked into one batch and fit together.
+
+    Args:
+        levels, n, k: Padded arrays as returned by group_counts
+        n_boot: Number of bootstrap replicates per group
+        ci: Width of the confidence interval in percent
+        seed: Seed for the resampling
+        **fit_kwargs: Passed on to fit_psychometric
+
+    Returns:
+        (n_groups, 3, 2) array with the lower and upper bound of threshold,
+        slope and lapse
+
+    """
+    rng = np.random.default_rng(seed)
+    p_hat = np.divide(k, n, out=np.zeros_like(k), where=n > 0)
+    k_boot = rng.binomial(n.astype(int)[:, None], p_hat[:, None], size=(len(n), n_boot, n.shape[1]))
+
+    fits = fit_psychometric(np.repeat(levels, n_boot, axis=0), np.repeat(n, n_boot, axis=0),
+                            k_boot.reshape(-1, n.shape[1]).astype(float), **fit_kwargs)
+    fits = fits[:, :3].reshape(len(n), n_boot, 3)
+
+    alpha = (100 - ci) / 2
+    return np.percentile(fits, [alpha, 100 - alpha], axis=1).transpose(1, 2, 0)
+
+
+def fit_all(data_dir, kind='logistic', n_boot=0, n_jobs=1, seed=None):
+    """Fit every group of every session in data_dir
+
+    Returns:
+        list of dicts, one per group, ready to be written with csv.DictWriter
+
+    """
+    trials = load_sessions(data_dir)
+    keys, levels, n, k = group_counts(trials)
+    fits = fit_psychometric(levels, n, k, kind=kind, n_jobs=n_jobs)
+    if n_boot:
+        cis = bootstrap_ci(levels, n, k, n_boot=n_boot, seed=seed, kind=kind, n_jobs=n_jobs)
+
+    results = []
+    for ii, key in enumerate(keys):
+        row = dict(zip(GROUP_FIELDS, key))
+        row.update({'Kind': kind, 'N Trials': int(n[ii].sum()), 'N Levels': int((n[ii] > 0).sum()),
+                    'Threshold': fits[ii, 0], 'Slope': fits[ii, 1], 'Lapse': fits[ii, 2],
+                    'LogLik': fits[ii, 3]})
+        if n_boot:
+            for jj, name in enumerate(['Threshold', 'Slope', 'Lapse']):
+                row[f'{name} CI Low'], row[f'{name} CI High'] = cis[ii, jj]
+        results.append(row)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit psychometric functions to every session in a folder')
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('--kind', choices=sorted(GRIDS), default='logistic')
+    parser.add_argument('--boot', type=int, default=0, help='Number of bootstrap replicates (0 = no CIs)')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default='psychometric_fits.csv')
+    args = parser.parse_args()
+
+    results = fit_all(args.data_dir, kind=args.kind, n_boot=args.boot, n_jobs=args.jobs, seed=args.seed)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=results[0].keys(), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Fit {len(results)} groups, saved to {args.out}")
@@ -0,0 +1,324 @@
+"""
+Reward controller daemon
+
+Holds the pump's serial port open for the whole day so task scripts no
+longer open (and reset) it themselves, and several processes can share one
+pump. Scripts send reward commands ('r3', 'r4', 'r200', ...) as text lines
+over a local TCP socket. Commands are queued (a full queue is answered with
+BUSY so callers can back off), and one worker thread writes whatever is
+queued to the port and flushes it once; every completion is answered with
+its timestamp.
+
+Start it once per session and pump:
+
+    python reward_daemon.py --serial COM4
+    python reward_daemon.py --serial COM4 --fake   # no hardware, for testing
+
+and in the task replace serial.Serial("COM4", 115200) with
+
+    port = open_reward_port("COM4", 115200)
+
+which talks to the daemon of that serial port when it runs and opens the
+port directly otherwise. Every serial port has its own TCP port
+(daemon_port), and the daemon names its serial port when a client connects,
+so a task can never reach the pump of another serial port. port.write waits
+for the reply and prints a warning for a reward that was not given.
+
+Protocol, one line per message:
+    daemon -> client:  HELLO COM4             on connecting
+    client -> daemon:  r4
+    daemon -> client:  DONE r4 <time queued> <time written>
+                       BUSY r4
+                       ERROR r4 <reason>
+"""
+
+import argparse
+import queue
+import re
+import socket
+import socketserver
+import threading
+import time
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 50556
+
+
+def daemon_port(serial_port):
+    """TCP port of the daemon of a serial port: DEFAULT_PORT plus its number, e.g. 50560 for COM4"""
+    match = re.search(r'(\d+)$', serial_port)
+    return DEFAULT_PORT + int(match.group(1)) if match else DEFAULT_PORT
+
+
+class FakeSerial:
+    """Stand-in for serial.Serial that records what was written
+
+    Args:
+        delay: Seconds each write takes, to mimic a slow controller
+
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.written = []
+        self.is_open = True
+
+    def write(self, data):
+        time.sleep(self.delay)
+        self.written.append((time.time(), data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One client connection: queues every command line it receives"""
+
+    def handle(self):
+        lock = threading.Lock()
+        _reply(self.wfile, lock, f"HELLO {self.server.daemon.serial_port}")
+        for line in self.rfile:
+            command = line.decode().strip()
+            if not command:
+                continue
+            try:
+                self.server.daemon.commands.put_nowait((command, time.time(), self.wfile, lock))
+            except queue.Full:
+                self.server.daemon.rejected += 1
+                _reply(self.wfile, lock, f"BUSY {command}")
+
+
+def _reply(wfile, lock, message):
+    try:
+        with lock:
+            wfile.write((message + '\n').encode())
+            wfile.flush()
+    except OSError:
+        pass  # The client went away, the reward was still given
+
+
+class RewardDaemon:
+    """Owns the serial port and serves reward commands from local clients
+
+    Args:
+        serial_port: Serial port of the controller, e.g. 'COM4'. Only named to
+            clients if backend is given
+        baudrate: Baud rate of the controller
+        backend: Object with write/flush/close to use instead of opening serial_port
+            (e.g. FakeSerial)
+        host: Address to listen on
+        port: TCP port to listen on. daemon_port(serial_port) if None
+        max_pending: Commands that may wait in the queue before new ones get BUSY
+        max_batch: Largest number of queued commands written with one flush
+
+    """
+
+    def __init__(self, serial_port='COM4', baudrate=115200, backend=None, host=DEFAULT_HOST,
+                 port=None, max_pending=16, max_batch=8):
+        if backend is None:
+            import serial
+            backend = serial.Serial(serial_port, baudrate)
+        self.serial_port = serial_port
+        self.serial = backend
+        self.commands = queue.Queue(maxsize=max_pending)
+        self.max_batch = max_batch
+        self.completed = 0
+        self.rejected = 0
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        port = daemon_port(serial_port) if port is None else port
+        self.server = socketserver.ThreadingTCPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        self.address = self.server.server_address
+
+        self._worker = threading.Thread(target=self._run, name='reward-writer', daemon=True)
+        self._server_thread = None
+
+    def _run(self):
+        while True:
+            item = self.commands.get()
+            if item is None:
+                break
+            # Take whatever else is already waiting and send it with one flush
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.commands.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.commands.put(None)
+                    break
+                batch.append(item)
+
+            written = []
+            for command, queued_at, wfile, lock in batch:
+                try:
+                    self.serial.write(command.encode())
+                except Exception as e:
+                    _reply(wfile, lock, f"ERROR {command} {e}")
+                    continue
+                written.append((command, queued_at, wfile, lock))
+            try:
+                self.serial.flush()
+            except Exception as e:
+                for command, _, wfile, lock in written:
+                    _reply(wfile, lock, f"ERROR {command} {e}")
+                continue
+            done_at = time.time()
+            for command, queued_at, wfile, lock in written:
+                self.completed += 1
+                _reply(wfile, lock, f"DONE {command} {queued_at:.6f} {done_at:.6f}")
+
+    def start(self):
+        """Serve in background threads"""
+        self._worker.start()
+        self._server_thread = threading.Thread(target=self.server.serve_forever, name='reward-server', daemon=True)
+        self._server_thread.start()
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted"""
+        self._worker.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.commands.put(None)
+        self._worker.join(1.0)
+        self.serial.close()
+
+
+class RewardClient:
+    """Sends reward commands to a running RewardDaemon
+
+    Args:
+        host: Address of the daemon
+        port: TCP port of the daemon
+        timeout: Seconds to wait for the connection and for replies
+        serial_port: Serial port the daemon must be serving. Any if None
+
+    Raises:
+        ConnectionError: If the daemon serves another serial port
+
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=1.0, serial_port=None):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.serial_port = serial_port
+        self.failed = []  # Commands write could not get confirmed
+        self._connect()
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.sock.settimeout(self.timeout)
+        self.rfile = self.sock.makefile('rb')
+        try:
+            fields = self.reply()
+        except OSError:
+            fields = []
+        served = fields[1] if len(fields) > 1 and fields[0] == 'HELLO' else None
+        if served is None or (self.serial_port is not None and served.upper() != self.serial_port.upper()):
+            self.close()
+            raise ConnectionError(f"Reward daemon at {self.address[0]}:{self.address[1]} does not serve "
+                                  f"{self.serial_port}: {' '.join(fields) or 'no greeting'}")
+
+    def send(self, command):
+        """Queue a command without waiting for it to complete"""
+        self.sock.sendall((command.strip() + '\n').encode())
+
+    def reply(self):
+        """Next reply from the daemon, split into its fields"""
+        return self.rfile.readline().decode().split()
+
+    def reward(self, command):
+        """Send a command and wait for it to be written
+
+        Returns:
+            Time (time.time()) the command was written to the controller
+
+        Raises:
+            RuntimeError: If the daemon was busy, the write failed or there was no reply
+
+        """
+        self.send(command)
+        try:
+            fields = self.reply()
+        except socket.timeout:
+            # A late reply would be taken for the next command's, so start a new connection
+            self.close()
+            self._connect()
+            raise RuntimeError(f"Reward '{command}' not confirmed: no reply within {self.timeout} s")
+        if not fields or fields[0] != 'DONE':
+            raise RuntimeError(f"Reward '{command}' not given: {' '.join(fields) or 'no reply'}")
+        return float(fields[3])
+
+    def write(self, data):
+        """Same as serial.Serial.write, so the client can stand in for the port
+
+        Waits for the reward to be written. A reward the daemon rejects (BUSY,
+        ERROR) or does not confirm is printed as a warning, added to
+        self.failed, and 0 is returned instead of the number of bytes.
+        """
+        command = data.decode() if isinstance(data, bytes) else data
+        try:
+            self.reward(command)
+        except (RuntimeError, OSError) as e:
+            print(f"WARNING: {e}")
+            self.failed.append(command)
+            return 0
+        return len(data)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def open_reward_port(serial_port, baudrate=115200, host=DEFAULT_HOST, port=None):
+    """Client of the serial port's reward daemon if one is running, else the serial port itself
+
+    Both have a write method taking the encoded command, e.g. port.write(str.encode('r4'))
+
+    Args:
+        serial_port: Serial port of the pump, e.g. 'COM4'
+        baudrate: Baud rate for opening the port directly
+        host: Address of the daemon
+        port: TCP port of the daemon. daemon_port(serial_port) if None
+
+    """
+    port = daemon_port(serial_port) if port is None else port
+    try:
+        return RewardClient(host, port, timeout=0.5, serial_port=serial_port)
+    except ConnectionRefusedError:
+        pass  # No daemon running
+    except OSError as e:
+        print(f"WARNING: {e}; opening {serial_port} directly")
+    import serial
+    return serial.Serial(serial_port, baudrate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hold the reward controller serial port and serve reward commands')
+    parser.add_argument('--serial', default='COM4', help='Serial port of the reward controller')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--port', type=int, default=None,
+                        help='Local TCP port to listen on (default: derived from the serial port)')
+    parser.add_argument('--fake', action='store_true', help='Use a fake serial port (no hardware)')
+    args = parser.parse_args()
+
+    daemon = RewardDaemon(args.serial, args.baud, backend=FakeSerial() if args.fake else None, port=args.port)
+    print(f"Reward daemon on {daemon.address[0]}:{daemon.address[1]} using "
+          f"{'a fake serial port' if args.fake else args.serial}")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
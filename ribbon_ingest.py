@@ -0,0 +1,163 @@
+"""
+One-pass ingest of the IHC ribbon volume workbook
+
+Each sheet of IHCRibbonVolData.xlsx is one ear (e.g. '108R'). Its first row
+holds the frequency place of every column (repeated once per voxel), the
+second row the voxel labels and the rest the ribbon volumes. Every sheet is
+read once and turned into rows of a single long-format table
+
+    (case, ear, freq, voxel, volume)
+
+which is cached as a .npy structured array next to the workbook. The cache
+is memory-mapped on later loads and rebuilt whenever the workbook changes.
+
+From the command line:
+
+    python ribbon_ingest.py IHCRibbonVolData.xlsx --jobs 4
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+RIBBON_DTYPE = np.dtype([('case', 'U8'), ('ear', 'U1'), ('freq', 'f8'), ('voxel', 'i2'), ('volume', 'f8')])
+
+
+def _freq_value(header):
+    """Frequency place (kHz) of a column header, NaN for empty headers"""
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def read_sheet(filename, sheet):
+    """Read one ear's sheet into long format
+
+    Columns without a frequency header are skipped. Voxels are numbered
+    1, 2, ... in column order within each frequency place.
+
+    Args:
+        filename: Path to the workbook
+        sheet: Sheet name, e.g. '108R'
+
+    Returns:
+        Structured array with RIBBON_DTYPE
+
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        rows = list(wb[sheet].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+    if len(rows) < 3:
+        return np.empty(0, dtype=RIBBON_DTYPE)
+
+    freqs = np.array([_freq_value(h) for h in rows[0]])
+
+    # Volumes as one float block, empty cells become NaN
+    width = len(rows[0])
+    volumes = np.array([tuple(r) + (None,) * (width - len(r)) for r in rows[2:]], dtype=float)
+
+    # Voxel number of every column within its frequency place
+    voxels = np.zeros(width, dtype='i2')
+    _, inverse = np.unique(np.nan_to_num(freqs, nan=-1), return_inverse=True)
+    for group in np.unique(inverse):
+        cols = np.flatnonzero(inverse == group)
+        voxels[cols] = np.arange(1, len(cols) + 1)
+
+    # Keep the non-empty cells of headed columns, column by column
+    keep = ~np.isnan(volumes) & ~np.isnan(freqs)
+    col, row = np.nonzero(keep.T)
+
+    table = np.empty(len(col), dtype=RIBBON_DTYPE)
+    table['case'] = sheet[:-1]
+    table['ear'] = sheet[-1]
+    table['freq'] = freqs[col]
+    table['voxel'] = voxels[col]
+    table['volume'] = volumes[row, col]
+    return table
+
+
+def ingest_workbook(filename, n_jobs=1):
+    """Read every sheet of the workbook into one long-format table
+
+    Args:
+        filename: Path to the workbook
+        n_jobs: Number of worker processes reading sheets in parallel
+
+    Returns:
+        Structured array with RIBBON_DTYPE, sheets in workbook order
+
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    sheets = wb.sheetnames
+    wb.close()
+
+    if n_jobs == 1:
+        tables = [read_sheet(filename, s) for s in sheets]
+    else:
+        with ProcessPoolExecutor(n_jobs) as pool:
+            tables = list(pool.map(read_sheet, [filename] * len(sheets), sheets))
+    return np.concatenate(tables)
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {'source': os.path.abspath(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_ribbons(filename='IHCRibbonVolData.xlsx', cache_file=None, n_jobs=1, mmap=True):
+    """Long-format ribbon volume table, from the cache when it is up to date
+
+    Args:
+        filename: Path to the workbook
+        cache_file: Path of the .npy cache. Defaults to '<workbook>.ribbons.npy'
+        n_jobs: Number of worker processes used if the workbook has to be read
+        mmap: Memory-map the cached table instead of reading it into memory
+
+    Returns:
+        Structured array with RIBBON_DTYPE
+
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(filename)[0] + '.ribbons.npy'
+    stamp_file = cache_file + '.json'
+    stamp = _source_stamp(filename)
+
+    try:
+        with open(stamp_file) as f:
+            up_to_date = json.load(f) == stamp
+    except (OSError, ValueError):
+        up_to_date = False
+
+    if not up_to_date or not os.path.isfile(cache_file):
+        table = ingest_workbook(filename, n_jobs=n_jobs)
+
+        # Write to a temporary name first so a half-written cache is never picked up
+        tmp_file = cache_file + '.tmp.npy'
+        np.save(tmp_file, table)
+        os.replace(tmp_file, cache_file)
+        with open(stamp_file, 'w') as f:
+            json.dump(stamp, f)
+
+    return np.load(cache_file, mmap_mode='r' if mmap else None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the ribbon volume workbook to a cached long-format table')
+    parser.add_argument('filename', nargs='?', default='IHCRibbonVolData.xlsx')
+    parser.add_argument('--cache', default=None, help='Path of the .npy cache')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of sheets read in parallel')
+    args = parser.parse_args()
+
+    table = load_ribbons(args.filename, cache_file=args.cache, n_jobs=args.jobs)
+    print(f"{len(table)} ribbons from {len(np.unique(table['case'] + table['ear']))} ears")
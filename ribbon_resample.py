@@ -0,0 +1,144 @@
+"""
+Bootstrap and permutation statistics for ribbon volume group comparisons
+
+For every (group pair, frequency bin) the difference in mean (or median)
+ribbon volume gets a percentile bootstrap CI and a two-sided permutation
+p-value. Resamples are drawn as (block, n_ribbons) index arrays so memory
+stays bounded, and blocks can be spread over a process pool. Each block has
+its own seed spawned from one SeedSequence, so results only depend on the
+seed, not on the number of workers.
+
+From the command line:
+
+    python ribbon_resample.py IHCRibbonVolData.xlsx --boot 10000 --perm 10000 --jobs 4
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ribbon_stats import BIN_EDGES, GROUPS, assign_bins, default_bin_names, group_mask
+
+RESAMPLE_DTYPE = np.dtype([('group_a', 'U32'), ('group_b', 'U32'), ('bin', 'U16'), ('n_a', 'i8'), ('n_b', 'i8'),
+                           ('diff', 'f8'), ('ci_low', 'f8'), ('ci_high', 'f8'), ('p_value', 'f8')])
+
+STATISTICS = {'mean': np.mean, 'median': np.median}
+
+
+def _bootstrap_block(a, b, n_boot, seed, statistic):
+    """Bootstrap differences statistic(a) - statistic(b) for one block"""
+    rng = np.random.default_rng(seed)
+    stat = STATISTICS[statistic]
+    boot_a = stat(a[rng.integers(0, len(a), (n_boot, len(a)))], axis=1)
+    boot_b = stat(b[rng.integers(0, len(b), (n_boot, len(b)))], axis=1)
+    return boot_a - boot_b
+
+
+def _permutation_block(pooled, n_a, n_perm, seed, statistic):
+    """Differences statistic(a) - statistic(b) under random relabelling, for one block"""
+    rng = np.random.default_rng(seed)
+    perm = rng.permuted(np.broadcast_to(np.arange(len(pooled)), (n_perm, len(pooled))), axis=1)
+    values = pooled[perm]
+    if statistic == 'mean':
+        # The complement's sum follows from the total, no need to touch it
+        sum_a = values[:, :n_a].sum(axis=1)
+        return sum_a / n_a - (pooled.sum() - sum_a) / (len(pooled) - n_a)
+    stat = STATISTICS[statistic]
+    return stat(values[:, :n_a], axis=1) - stat(values[:, n_a:], axis=1)
+
+
+def _run_blocks(pool, func, data, n_total, n_items, seed_seq, statistic, max_elements):
+    """Run n_total resamples of func in blocks of at most max_elements drawn values"""
+    block = max(1, int(max_elements // n_items))
+    sizes = [min(block, n_total - start) for start in range(0, n_total, block)]
+    seeds = seed_seq.spawn(len(sizes))
+    if pool is None:
+        return np.concatenate([func(*data, size, s, statistic) for size, s in zip(sizes, seeds)])
+    futures = [pool.submit(func, *data, size, s, statistic) for size, s in zip(sizes, seeds)]
+    return np.concatenate([f.result() for f in futures])
+
+
+def compare_groups(table, pairs=None, groups=GROUPS, edges=BIN_EDGES, bin_names=None, n_boot=10000,
+                   n_perm=10000, ci=95, statistic='mean', seed=None, n_jobs=1, max_elements=2e7):
+    """Resampling comparison of ribbon volumes per (group pair, frequency bin)
+
+    Args:
+        table: Long-format ribbon table (see ribbon_ingest.load_ribbons)
+        pairs: List of (group_a, group_b). Defaults to every group against 'control'
+        groups: dict mapping group name to its members (see ribbon_stats.group_mask)
+        edges: Bin edges in kHz, bins are (edges[i], edges[i+1]]
+        bin_names: Name of each bin. Defaults to ribbon_stats.default_bin_names(edges)
+        n_boot: Number of bootstrap resamples
+        n_perm: Number of permutations
+        ci: Width of the bootstrap confidence interval in percent
+        statistic: 'mean' or 'median'
+        seed: Seed of the SeedSequence every block's seed is spawned from
+        n_jobs: Number of worker processes
+        max_elements: Largest number of resampled values held by one block
+
+    Returns:
+        Structured array with RESAMPLE_DTYPE
+
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic '{statistic}', use one of {sorted(STATISTICS)}")
+    if pairs is None:
+        pairs = [(name, 'control') for name in groups if name != 'control']
+
+    if bin_names is None:
+        bin_names = default_bin_names(edges)
+    if len(bin_names) != len(edges) - 1:
+        raise ValueError(f"{len(bin_names)} bin names for {len(edges) - 1} bins")
+
+    volume = np.asarray(table['volume'])
+    bins = assign_bins(np.asarray(table['freq']), edges)
+    masks = {name: group_mask(table, groups[name]) for name in {g for pair in pairs for g in pair}}
+    root = np.random.SeedSequence(seed)
+    alpha = (100 - ci) / 2
+
+    pool = ProcessPoolExecutor(n_jobs) if n_jobs > 1 else None
+    results = []
+    try:
+        for (name_a, name_b), pair_seq in zip(pairs, root.spawn(len(pairs))):
+            for b, bin_seq in enumerate(pair_seq.spawn(len(edges) - 1)):
+                a = volume[masks[name_a] & (bins == b)]
+                bb = volume[masks[name_b] & (bins == b)]
+                if not len(a) or not len(bb):
+                    continue
+                boot_seq, perm_seq = bin_seq.spawn(2)
+                observed = STATISTICS[statistic](a) - STATISTICS[statistic](bb)
+
+                boot = _run_blocks(pool, _bootstrap_block, (a, bb), n_boot, len(a) + len(bb), boot_seq,
+                                   statistic, max_elements)
+                perm = _run_blocks(pool, _permutation_block, (np.concatenate((a, bb)), len(a)), n_perm,
+                                   len(a) + len(bb), perm_seq, statistic, max_elements)
+
+                p_value = (np.sum(np.abs(perm) >= abs(observed)) + 1) / (n_perm + 1)
+                ci_low, ci_high = np.percentile(boot, [alpha, 100 - alpha])
+                results.append((name_a, name_b, bin_names[b], len(a), len(bb), observed, ci_low, ci_high, p_value))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return np.array(results, dtype=RESAMPLE_DTYPE)
+
+
+if __name__ == '__main__':
+    from ribbon_ingest import load_ribbons
+
+    parser = argparse.ArgumentParser(description='Bootstrap CIs and permutation tests of ribbon volume per group and bin')
+    parser.add_argument('filename', nargs='?', default='IHCRibbonVolData.xlsx')
+    parser.add_argument('--boot', type=int, default=10000, help='Number of bootstrap resamples')
+    parser.add_argument('--perm', type=int, default=10000, help='Number of permutations')
+    parser.add_argument('--statistic', choices=sorted(STATISTICS), default='mean')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes')
+    args = parser.parse_args()
+
+    res = compare_groups(load_ribbons(args.filename), n_boot=args.boot, n_perm=args.perm,
+                         statistic=args.statistic, seed=args.seed, n_jobs=args.jobs)
+    print(f"{'comparison':<28}{'bin':<7}{'n_a':>7}{'n_b':>7}{'diff':>9}{'ci_low':>9}{'ci_high':>9}{'p':>9}")
+    for row in res:
+        print(f"{row['group_a'] + ' vs ' + row['group_b']:<28}{row['bin']:<7}{row['n_a']:>7}{row['n_b']:>7}"
+              f"{row['diff']:>9.4f}{row['ci_low']:>9.4f}{row['ci_high']:>9.4f}{row['p_value']:>9.4f}")
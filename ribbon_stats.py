@@ -0,0 +1,152 @@
+"""
+Frequency-bin and group summaries of ribbon volumes
+
+Python counterpart of the binning section of
+Histo_ImportandPlotRibbonVolume_SpecificEars_binnedFreq.m, working on the
+long-format table from ribbon_ingest. Frequency places are mapped to bins
+with a single digitize and every statistic is a grouped reduction over the
+(group, bin) cells, so any grouping and any bin edges cost the same.
+
+From the command line:
+
+    python ribbon_stats.py IHCRibbonVolData.xlsx --edges 0 2 8 inf
+"""
+
+import argparse
+
+import numpy as np
+
+# Groups of the noise exposure study. Case IDs select both ears of a case,
+# ear names select single ears
+GROUPS = {
+    'M_long': [108, 109, 110, 114, 124, 125],
+    'F_long': [119, 120, 122, 123],
+    'M_short': [26, 28, 117, 118, 121],
+    'control': [103, 104, 111, 112, 113],
+    'specific_ears': ['108R', '110L', '114R', '125L', '125R', '119R', '120R'],
+}
+
+# Frequency place bins (kHz) used in the MATLAB script, (low, high]
+BIN_EDGES = [0, 2, 8, np.inf]
+BIN_NAMES = ['low', 'mid', 'high']
+
+STATS_DTYPE = np.dtype([('group', 'U32'), ('bin', 'U16'), ('n', 'i8'), ('mean', 'f8'), ('sd', 'f8'),
+                        ('iqr', 'f8'), ('skewness', 'f8'), ('range', 'f8')])
+
+
+def assign_bins(freq, edges):
+    """Bin index of every frequency place
+
+    Bins are closed on the right, (edges[i], edges[i+1]], as in the MATLAB
+    script. Places outside all bins get -1.
+    """
+    edges = np.asarray(edges, dtype=float)
+    idx = np.digitize(freq, edges, right=True) - 1
+    idx[(idx < 0) | (idx >= len(edges) - 1)] = -1
+    return idx
+
+
+def default_bin_names(edges):
+    """BIN_NAMES for the default edges, otherwise names made of the edges, e.g. '0-2'"""
+    if list(edges) == list(BIN_EDGES):
+        return list(BIN_NAMES)
+    return [f'{lo:g}-{hi:g}' for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def group_mask(table, members):
+    """Rows of the table that belong to a group
+
+    Args:
+        table: Long-format ribbon table
+        members: Case IDs (e.g. 108, both ears) and/or ear names (e.g. '108R')
+
+    """
+    cases = [str(m) for m in members if not isinstance(m, str)]
+    ears = [m for m in members if isinstance(m, str)]
+    mask = np.isin(table['case'], cases)
+    if ears:
+        mask |= np.isin(np.char.add(table['case'], table['ear']), ears)
+    return mask
+
+
+def _hazen_percentile(sorted_values, starts, counts, q):
+    """Percentile q (0-100) of every run in sorted_values, as MATLAB's prctile"""
+    pos = np.clip(counts * q / 100 + 0.5, 1, counts) - 1
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, counts - 1)
+    frac = pos - lo
+    return sorted_values[starts + lo] * (1 - frac) + sorted_values[starts + hi] * frac
+
+
+def bin_stats(table, groups=GROUPS, edges=BIN_EDGES, bin_names=None):
+    """Summary statistics of ribbon volume per (group, frequency bin)
+
+    Args:
+        table: Long-format ribbon table (see ribbon_ingest.load_ribbons)
+        groups: dict mapping group name to its members (see group_mask)
+        edges: Bin edges in kHz, bins are (edges[i], edges[i+1]]
+        bin_names: Name of each bin. Defaults to default_bin_names(edges)
+
+    Returns:
+        Structured array with STATS_DTYPE, one row per non-empty (group, bin),
+        with n, mean, SD, IQR, skewness and range of the volumes
+
+    """
+    n_bins = len(edges) - 1
+    if bin_names is None:
+        bin_names = default_bin_names(edges)
+    group_names = list(groups)
+
+    volume = np.asarray(table['volume'])
+    bins = assign_bins(np.asarray(table['freq']), edges)
+
+    # A row may belong to several groups, so stack the selection of every group
+    rows = []
+    cells = []
+    for g, name in enumerate(group_names):
+        idx = np.flatnonzero(group_mask(table, groups[name]) & (bins >= 0))
+        rows.append(idx)
+        cells.append(g * n_bins + bins[idx])
+    rows = np.concatenate(rows)
+    cells = np.concatenate(cells)
+
+    # Sort by cell, then volume, so each cell is one sorted run
+    order = np.lexsort((volume[rows], cells))
+    values = volume[rows][order]
+    cells = cells[order]
+    keys, starts, counts = np.unique(cells, return_index=True, return_counts=True)
+
+    # Moments from grouped sums
+    mean = np.add.reduceat(values, starts) / counts
+    dev = values - np.repeat(mean, counts)
+    m2 = np.add.reduceat(dev ** 2, starts) / counts
+    m3 = np.add.reduceat(dev ** 3, starts) / counts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.sqrt(m2 * counts / (counts - 1))
+        skewness = m3 / m2 ** 1.5
+
+    out = np.empty(len(keys), dtype=STATS_DTYPE)
+    out['group'] = np.array(group_names)[keys // n_bins]
+    out['bin'] = np.array(bin_names)[keys % n_bins]
+    out['n'] = counts
+    out['mean'] = mean
+    out['sd'] = sd
+    out['iqr'] = _hazen_percentile(values, starts, counts, 75) - _hazen_percentile(values, starts, counts, 25)
+    out['skewness'] = skewness
+    out['range'] = values[starts + counts - 1] - values[starts]
+    return out
+
+
+if __name__ == '__main__':
+    from ribbon_ingest import load_ribbons
+
+    parser = argparse.ArgumentParser(description='Summarize ribbon volumes per group and frequency bin')
+    parser.add_argument('filename', nargs='?', default='IHCRibbonVolData.xlsx')
+    parser.add_argument('--edges', type=float, nargs='+', default=BIN_EDGES, help='Bin edges in kHz')
+    args = parser.parse_args()
+
+    stats = bin_stats(load_ribbons(args.filename), edges=args.edges)
+    print(f"{'group':<16}{'bin':<10}{'n':>7}{'mean':>9}{'sd':>9}{'iqr':>9}{'skew':>9}{'range':>9}")
+    for row in stats:
+        print(f"{row['group']:<16}{row['bin']:<10}{row['n']:>7}{row['mean']:>9.3f}{row['sd']:>9.3f}"
+              f"{row['iqr']:>9.3f}{row['skewness']:>9.3f}{row['range']:>9.3f}")
@@ -0,0 +1,366 @@
+"""
+Run several rigs of the task in parallel from one config
+
+Every rig is a headless task engine in its own process. The orchestrator
+renders the cue and choice tone sequences of the soundslist once into a
+shared memory block that the engines map read-only, so N rigs cost one
+bank of memory and no synthesis. Engines report trials and heartbeats over
+one queue; the orchestrator writes a CSV per rig, a common log, and flags
+rigs that stall or die.
+
+Engines have no window, so responses come from a simulated subject whose
+accuracy follows a psychometric function of coherence. Rewards for those
+made-up responses go to a FakeSerial; "reward" must be "fake", and a config
+naming a serial port is rejected, so no pump is ever driven by the simulation.
+Audio is timed but silent with "audio": "null" and played through
+sounddevice with "audio": "sounddevice".
+
+Config (JSON):
+
+    {"soundslist": "soundslist.csv", "variants": 20, "seed": 1, "data_dir": "rigs",
+     "defaults": {"nReps": 10, "wm_delay": 0.5, "iti": 1.0, "speed": 1.0,
+                  "reward": "fake", "audio": "null"},
+     "rigs": [{"name": "rig1"}, {"name": "rig2", "threshold": 0.7}]}
+
+    python rig_orchestrator.py rigs.json
+    python rig_orchestrator.py --simulate 8 --reps 5 --speed 20   # scaling test
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+import traceback
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tone_synthesis import generate_mono_tone_sequence
+
+RIG_DEFAULTS = {
+    'nReps': 10,
+    'wm_delay': 0.5,
+    'iti': 1.0,
+    'max_response_time': 10.0,
+    'speed': 1.0,  # Time compression of all waits, for simulated rigs
+    'reward': 'fake',  # Only 'fake': the responses are simulated
+    'audio': 'null',  # 'null' or 'sounddevice'
+    'threshold': 0.6,  # Simulated subject
+    'slope': 10.0,
+    'lapse': 0.05,
+    'rt_mean': 1.5,
+    'seed': None,
+}
+
+
+class StimulusBank:
+    """Cue and choice sequences of a soundslist in shared memory
+
+    The bank is a (rows, variants, 2, samples) float32 array: for every
+    soundslist row, 'variants' renderings of its cue (index 0) and choice
+    (index 1) sequences. Engines pick a variant per trial.
+
+    Args:
+        shm: SharedMemory block holding the array
+        shape: Shape of the array
+        owner: Whether this process created the block and must unlink it
+
+    """
+
+    def __init__(self, shm, shape, owner=False):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.owner = owner
+        self.sequences = np.ndarray(self.shape, dtype='float32', buffer=shm.buf)
+        if not owner:
+            self.sequences.flags.writeable = False
+
+    @classmethod
+    def render(cls, stimuli_parameters, variants=20, seed=None, samplingRate=44100):
+        """Render every soundslist row into a new shared memory block"""
+        seeds = np.random.SeedSequence(seed).generate_state(len(stimuli_parameters) * variants)
+        first = generate_mono_tone_sequence(0.5, 1000, 0.5, samplingRate)
+        shape = (len(stimuli_parameters), variants, 2, len(first))
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        bank = cls(shm, shape, owner=True)
+        for row, params in enumerate(stimuli_parameters):
+            coherence = float(params['coherence'])
+            for v in range(variants):
+                # One seed per (row, variant); the choice draws continue from the cue's state
+                bank.sequences[row, v, 0] = generate_mono_tone_sequence(
+                    coherence, float(params['cue_frequency']), float(params['cue_frequency_range']),
+                    samplingRate, seed=int(seeds[row * variants + v]))
+                bank.sequences[row, v, 1] = generate_mono_tone_sequence(
+                    coherence, float(params['choice_frequency']), float(params['choice_frequency_range']),
+                    samplingRate)
+        bank.sequences.flags.writeable = False
+        return bank
+
+    @classmethod
+    def attach(cls, name, shape):
+        """Map an existing bank read-only, in an engine process"""
+        return cls(shared_memory.SharedMemory(name=name), shape)
+
+    @property
+    def spec(self):
+        """What an engine needs to attach: (name, shape)"""
+        return self.shm.name, self.shape
+
+    def close(self):
+        del self.sequences
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_engine(rig, stimuli_parameters, bank_spec, events, samplingRate=44100):
+    """Headless task loop of one rig, run in its own process
+
+    Sends ('trial', name, data), ('health', name, data), ('done', name, data)
+    and ('error', name, traceback) tuples to the events queue.
+
+    Args:
+        rig: Rig settings (RIG_DEFAULTS updated with the config)
+        stimuli_parameters: Rows of the soundslist
+        bank_spec: StimulusBank.spec of the shared bank
+        events: multiprocessing queue read by the orchestrator
+        samplingRate: Sampling rate of the bank
+
+    """
+    name = rig['name']
+    try:
+        from psychometric import psychometric
+        from reward_daemon import FakeSerial
+
+        bank = StimulusBank.attach(*bank_spec)
+        rng = np.random.default_rng(rig['seed'])
+        if rig['reward'] != 'fake':
+            raise ValueError(f"Rig {name}: simulated responses cannot reward {rig['reward']}, use 'fake'")
+        port = FakeSerial()
+        speed = rig['speed']
+        if rig['audio'] == 'sounddevice':
+            import sounddevice as sd
+
+            def present(sequence):
+                sd.play(sequence, samplingRate)
+                sd.wait()
+        else:
+            def present(sequence):
+                time.sleep(len(sequence) / samplingRate / speed)
+
+        # Trial order like data.TrialHandler(method='random'): each rep is a shuffle of the rows
+        order = np.concatenate([rng.permutation(len(stimuli_parameters)) for _ in range(rig['nReps'])])
+        start = last_beat = time.perf_counter()
+        cpu_start = time.process_time()
+        n_correct = 0
+        for trial_number, row in enumerate(order):
+            params = stimuli_parameters[row]
+            cue_frequency = float(params['cue_frequency'])
+            choice_frequency = float(params['choice_frequency'])
+            coherence = float(params['coherence'])
+            correct_response = 'same' if cue_frequency == choice_frequency else 'diff'
+            variant = rng.integers(bank.shape[1])
+
+            present(bank.sequences[row, variant, 0])
+            time.sleep(rig['wm_delay'] / speed)
+            present(bank.sequences[row, variant, 1])
+
+            rt = rng.exponential(rig['rt_mean'])
+            if rt > rig['max_response_time']:
+                response, rt = 'NA', rig['max_response_time']
+            elif rng.random() < psychometric(coherence, rig['threshold'], rig['slope'], rig['lapse']):
+                response = correct_response
+            else:
+                response = 'diff' if correct_response == 'same' else 'same'
+            time.sleep(rt / speed)
+
+            response_correct = response == correct_response
+            if response_correct:
+                port.write(str.encode('r4'))  # REWARD
+                n_correct += 1
+            events.put(('trial', name, {
+                'Trial Number': trial_number,
+                'Participant': name,
+                'Response': response,
+                'RT': rt,
+                'Variant': int(variant),
+                'Cue Frequency': cue_frequency,
+                'Cue Frequency Range': float(params['cue_frequency_range']),
+                'Choice Frequency': choice_frequency,
+                'Choice Frequency Range': float(params['choice_frequency_range']),
+                'Coherence': coherence,
+                'WM delay': rig['wm_delay'],
+                'Time': time.time(),
+            }))
+            time.sleep(rig['iti'] / speed)
+
+            now = time.perf_counter()
+            if now - last_beat >= 1.0:
+                events.put(('health', name, _health(trial_number + 1, n_correct, start, cpu_start)))
+                last_beat = now
+
+        events.put(('done', name, _health(len(order), n_correct, start, cpu_start)))
+        bank.close()
+        port.close()
+    except Exception:
+        events.put(('error', name, traceback.format_exc()))
+
+
+def _health(trials, n_correct, start, cpu_start):
+    wall = time.perf_counter() - start
+    health = {'trials': trials, 'pc': n_correct / trials if trials else float('nan'),
+              'trials_per_s': trials / wall if wall > 0 else 0.0,
+              'cpu': (time.process_time() - cpu_start) / wall if wall > 0 else 0.0}
+    try:
+        import resource
+        health['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass  # Not available on Windows
+    return health
+
+
+class Orchestrator:
+    """Starts one engine process per rig and aggregates what they report
+
+    Args:
+        config: Dict as in the module docstring
+        stall_timeout: Seconds without any message before a running rig is reported as stalled
+
+    Raises:
+        ValueError: If a rig names a reward other than 'fake'
+
+    """
+
+    def __init__(self, config, stall_timeout=10.0):
+        self.config = config
+        self.stall_timeout = stall_timeout
+        # Read here rather than with Functions_WM.load_stimuli_parameters, which loads psychopy
+        with open(config.get('soundslist', 'soundslist.csv'), newline='') as f:
+            self.stimuli_parameters = list(csv.DictReader(f))
+        defaults = dict(RIG_DEFAULTS, **config.get('defaults', {}))
+        self.rigs = [dict(defaults, **rig) for rig in config['rigs']]
+        for ii, rig in enumerate(self.rigs):
+            if rig['seed'] is None and config.get('seed') is not None:
+                rig['seed'] = config['seed'] + ii + 1
+            if rig['reward'] != 'fake':
+                # Responses are simulated; a real pump would reward trials no animal did
+                raise ValueError(f"Rig {rig['name']}: reward must be 'fake' with simulated responses, "
+                                 f"not {rig['reward']!r}")
+
+        self.data_dir = config.get('data_dir', 'rigs')
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.status = {rig['name']: {'state': 'starting', 'trials': 0, 'last_seen': None} for rig in self.rigs}
+        self._writers = {}
+        self._files = {}
+        self.log = open(os.path.join(self.data_dir, f"orchestrator_{self.stamp}.log"), 'a')
+
+    def _log(self, message):
+        line = f"{datetime.now().strftime('%H:%M:%S')} {message}"
+        print(line)
+        self.log.write(line + '\n')
+        self.log.flush()
+
+    def _write_trial(self, name, trial):
+        if name not in self._writers:
+            f = open(os.path.join(self.data_dir, f"{name}_{self.stamp}.csv"), 'w', newline='')
+            self._files[name] = f
+            self._writers[name] = csv.DictWriter(f, fieldnames=trial.keys(), extrasaction='ignore',
+                                                 lineterminator='\n')
+            self._writers[name].writeheader()
+        self._writers[name].writerow(trial)
+        self._files[name].flush()
+
+    def run(self, poll=0.5):
+        """Render the bank, run every rig to the end and return the status of each"""
+        start = time.perf_counter()
+        bank = StimulusBank.render(self.stimuli_parameters, self.config.get('variants', 20),
+                                   self.config.get('seed'))
+        self._log(f"Stimulus bank: {bank.sequences.nbytes / 1e6:.1f} MB shared by {len(self.rigs)} rigs, "
+                  f"rendered in {time.perf_counter() - start:.2f} s")
+
+        events = mp.Queue()
+        processes = {}
+        for rig in self.rigs:
+            p = mp.Process(target=run_engine, args=(rig, self.stimuli_parameters, bank.spec, events),
+                           name=rig['name'], daemon=True)
+            p.start()
+            processes[rig['name']] = p
+            self.status[rig['name']].update(state='running', last_seen=time.perf_counter())
+
+        try:
+            while any(s['state'] in ('running', 'stalled') for s in self.status.values()):
+                try:
+                    kind, name, payload = events.get(timeout=poll)
+                except queue.Empty:
+                    kind = None
+                now = time.perf_counter()
+                if kind is not None:
+                    status = self.status[name]
+                    status['last_seen'] = now
+                    if status['state'] == 'stalled':
+                        status['state'] = 'running'
+                        self._log(f"{name}: recovered")
+                    if kind == 'trial':
+                        self._write_trial(name, payload)
+                        status['trials'] += 1
+                    elif kind == 'health':
+                        status.update(payload)
+                    elif kind == 'done':
+                        status.update(payload, state='done')
+                        self._log(f"{name}: done, {payload['trials']} trials, PC {payload['pc']:.2f}")
+                    elif kind == 'error':
+                        status['state'] = 'failed'
+                        self._log(f"{name}: failed\n{payload}")
+
+                for name, status in self.status.items():
+                    if status['state'] not in ('running', 'stalled'):
+                        continue
+                    if not processes[name].is_alive() and events.empty():
+                        status['state'] = 'failed'
+                        self._log(f"{name}: engine exited with code {processes[name].exitcode}")
+                    elif status['state'] == 'running' and now - status['last_seen'] > self.stall_timeout:
+                        status['state'] = 'stalled'
+                        self._log(f"{name}: no message for {now - status['last_seen']:.0f} s")
+        finally:
+            for p in processes.values():
+                p.join(1.0)
+                if p.is_alive():
+                    p.terminate()
+            for f in self._files.values():
+                f.close()
+            bank.close()
+
+        wall = time.perf_counter() - start
+        total = sum(s['trials'] for s in self.status.values())
+        self._log(f"{total} trials from {len(self.rigs)} rigs in {wall:.1f} s ({total / wall:.1f} trials/s)")
+        self.log.close()
+        return self.status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several task rigs in parallel from one config')
+    parser.add_argument('config', nargs='?', help='JSON config file')
+    parser.add_argument('--simulate', type=int, default=0, help='Run this many simulated rigs instead of a config')
+    parser.add_argument('--soundslist', default='soundslist.csv')
+    parser.add_argument('--reps', type=int, default=5)
+    parser.add_argument('--speed', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--data-dir', default='rigs')
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    elif args.simulate:
+        config = {'soundslist': args.soundslist, 'seed': args.seed, 'data_dir': args.data_dir,
+                  'defaults': {'nReps': args.reps, 'speed': args.speed, 'reward': 'fake', 'audio': 'null'},
+                  'rigs': [{'name': f"sim{ii + 1}"} for ii in range(args.simulate)]}
+    else:
+        parser.error('Give a config file or --simulate N')
+
+    Orchestrator(config).run()
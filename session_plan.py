@@ -0,0 +1,150 @@
+"""
+Compiled session plans
+
+data.TrialHandler hands the shells the soundslist rows as strings, so every
+trial parses its frequencies and works out the correct answer again.
+compile_session does this once for the whole session: the soundslist is
+parsed into one typed row per stimulus, the trial order for nReps and the
+TrialHandler method is drawn up front, and the result is a structured array
+with one record per trial. The plan is saved next to the data file, so the
+exact order a session ran can be reloaded, and PlanHandler iterates it like
+a TrialHandler.
+
+    plan = compile_session(stimuli_parameters, nReps=400, method='random', wm_delay=wm_delay)
+    save_plan(plan, data_file_path)
+    trials = PlanHandler(plan)
+    for trial in trials:
+        cue_frequency = trial['cue_frequency']
+        correct_response = trial['correct_response']
+"""
+
+import os
+
+import numpy as np
+
+PLAN_DTYPE = np.dtype([('trial', 'i4'), ('rep', 'i4'), ('stimulus_id', 'i4'),
+                       ('cue_frequency', 'f8'), ('cue_frequency_range', 'f8'),
+                       ('choice_frequency', 'f8'), ('choice_frequency_range', 'f8'),
+                       ('coherence', 'f8'), ('correct_response', 'U4'),
+                       ('wm_delay', 'f8'), ('expected_duration', 'f8')])
+
+PARAMETER_FIELDS = ('cue_frequency', 'cue_frequency_range', 'choice_frequency', 'choice_frequency_range',
+                    'coherence')
+
+
+def parse_stimuli(stimuli_parameters, wm_delay=0.0, sequence_duration=0.5, lead_in=0.0):
+    """One typed record per soundslist row
+
+    Args:
+        stimuli_parameters: Rows as returned by load_stimuli_parameters
+        wm_delay: Delay between cue and choice (s)
+        sequence_duration: Duration of the cue and of the choice sequence (s)
+        lead_in: Time before the cue, e.g. pre-stimulus flashes (s)
+
+    Returns:
+        Structured array with PLAN_DTYPE; stimulus_id is the soundslist row
+
+    """
+    stimuli = np.zeros(len(stimuli_parameters), dtype=PLAN_DTYPE)
+    stimuli['stimulus_id'] = np.arange(len(stimuli))
+    for field in PARAMETER_FIELDS:
+        stimuli[field] = [float(row[field]) for row in stimuli_parameters]
+    stimuli['correct_response'] = np.where(stimuli['cue_frequency'] == stimuli['choice_frequency'], 'same', 'diff')
+    stimuli['wm_delay'] = wm_delay
+    # Stimulus part of the trial; the response period depends on the subject
+    stimuli['expected_duration'] = lead_in + 2 * sequence_duration + wm_delay
+    return stimuli
+
+
+def compile_trial(params, wm_delay=0.0, sequence_duration=0.5, lead_in=0.0):
+    """Single plan record for a trial chosen online, e.g. by QuestPlusHandler"""
+    record = parse_stimuli([params], wm_delay, sequence_duration, lead_in)[0]
+    record['stimulus_id'] = -1
+    return record
+
+
+def compile_session(stimuli_parameters, nReps, method='random', seed=None, wm_delay=0.0, sequence_duration=0.5,
+                    lead_in=0.0):
+    """Trial-by-trial plan of a whole session
+
+    Args:
+        stimuli_parameters: Rows as returned by load_stimuli_parameters
+        nReps: Repetitions of the soundslist
+        method: As in data.TrialHandler: 'sequential', 'random' (shuffled
+            within each repetition) or 'fullRandom' (shuffled across repetitions)
+        seed: Seed for the trial order. None draws a fresh order every session
+        wm_delay: Delay between cue and choice (s)
+        sequence_duration: Duration of the cue and of the choice sequence (s)
+        lead_in: Time before the cue (s)
+
+    Returns:
+        Structured array with PLAN_DTYPE, one record per trial in running order
+
+    """
+    stimuli = parse_stimuli(stimuli_parameters, wm_delay, sequence_duration, lead_in)
+    n = len(stimuli)
+    rng = np.random.default_rng(seed)
+
+    if method == 'sequential':
+        order = np.tile(np.arange(n), nReps)
+    elif method == 'random':
+        order = np.argsort(rng.random((nReps, n)), axis=1).ravel()
+    elif method == 'fullRandom':
+        order = rng.permutation(np.tile(np.arange(n), nReps))
+    else:
+        raise ValueError(f"Unknown method '{method}'")
+
+    plan = stimuli[order]
+    plan['trial'] = np.arange(len(plan))
+    plan['rep'] = np.arange(len(plan)) // n
+    return plan
+
+
+def plan_path(data_file_path):
+    """Path of the plan saved alongside a data file"""
+    return os.path.splitext(data_file_path)[0] + '_plan.npy'
+
+
+def save_plan(plan, data_file_path):
+    """Save the plan next to the data file, e.g. data/name_20240611-104743_plan.npy"""
+    path = plan_path(data_file_path)
+    np.save(path, plan)
+    return path
+
+
+def load_plan(path):
+    """Load a saved plan, given the plan itself or the data file it belongs to"""
+    if not path.endswith('.npy'):
+        path = plan_path(path)
+    return np.load(path)
+
+
+class PlanHandler:
+    """Iterates a compiled plan like data.TrialHandler iterates its trialList
+
+    Each trial is the plan record itself, so parameters are typed lookups.
+
+    Args:
+        plan: Structured array from compile_session
+        start: Index of the first trial to run
+
+    """
+
+    def __init__(self, plan, start=0):
+        self.plan = plan
+        self.nTotal = len(plan)
+        self.thisN = start - 1
+        self.thisTrial = None
+
+    def __len__(self):
+        return self.nTotal
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.thisN += 1
+        if self.thisN >= self.nTotal:
+            raise StopIteration
+        self.thisTrial = self.plan[self.thisN]
+        return self.thisTrial
@@ -0,0 +1,117 @@
+"""
+Precomputed spatial rendering for the spatial task variants
+
+play_tone recomputes its 0.5 s stereo buffer on every call. SpatialBank
+renders every (frequency, location) of a session once, with an interaural
+level difference (ILD, as left/right gains) and an interaural time
+difference (ITD, as a delay of the far ear), stores the buffers in one
+indexed block and builds each sound.Sound once, so a trial only looks up
+and plays.
+
+Locations are either an azimuth in degrees (negative = left), turned into
+ILD/ITD with a spherical-head model, or explicit gains as the shells use
+them, e.g. {'left_amp': 1.0, 'right_amp': AltSpkrAmp, 'itd': 0.0}.
+
+    bank = SpatialBank.from_parameters(stimuli_parameters,
+                                       {'left': {'left_amp': 1.0, 'right_amp': AltSpkrAmp},
+                                        'right': {'left_amp': AltSpkrAmp, 'right_amp': 1.0}})
+    bank.play(cue_frequency, 'left')
+"""
+
+import numpy as np
+from psychopy import core, sound
+
+from Functions_WM import create_mono_buffer, duration, sample_rate
+
+SPEED_OF_SOUND = 343.0  # m/s
+
+
+def azimuth_to_cues(azimuth, head_radius=0.0875, max_ild_db=15.0):
+    """ILD gains and ITD of a source at azimuth degrees (negative = left)
+
+    Uses Woodworth's spherical-head ITD and an ILD growing with sin(azimuth).
+
+    Returns:
+        dict with left_amp, right_amp and itd (s, positive = right ear lags)
+
+    """
+    theta = np.deg2rad(azimuth)
+    itd = head_radius / SPEED_OF_SOUND * (abs(theta) + abs(np.sin(theta)))
+    ild_db = max_ild_db * np.sin(theta)
+    # The near ear keeps full level, the far ear is attenuated
+    far = float(10 ** (-abs(ild_db) / 20))
+    itd = float(itd)
+    if azimuth < 0:
+        return {'left_amp': 1.0, 'right_amp': far, 'itd': itd}
+    return {'left_amp': far, 'right_amp': 1.0, 'itd': -itd}
+
+
+class SpatialBank:
+    """Stereo buffers for every (frequency, location), rendered up front
+
+    Args:
+        frequencies: Frequencies (Hz) to render
+        locations: dict mapping a location name to an azimuth (degrees) or
+            to a dict with left_amp, right_amp and optionally itd (s)
+
+    """
+
+    def __init__(self, frequencies, locations):
+        self.samplingRate = sample_rate
+        self.frequencies = sorted(set(float(f) for f in frequencies))
+        self.cues = {}
+        for name, loc in locations.items():
+            cues = azimuth_to_cues(loc) if np.isscalar(loc) else dict(loc)
+            cues.setdefault('itd', 0.0)
+            self.cues[name] = cues
+
+        # Longest ITD decides how much room the delayed ear needs
+        max_delay = max(int(round(abs(c['itd']) * sample_rate)) for c in self.cues.values())
+        n_samples = int(sample_rate * duration) + max_delay
+        self.duration = n_samples / sample_rate  # Of every buffer, delayed ear included
+
+        # One contiguous block, indexed by (frequency, location)
+        self.index = {}
+        self.buffers = np.zeros((len(self.frequencies) * len(self.cues), n_samples, 2), dtype='float32')
+        row = 0
+        for freq in self.frequencies:
+            mono = create_mono_buffer(freq)
+            for name, cues in self.cues.items():
+                delay = int(round(abs(cues['itd']) * sample_rate))
+                left_delay = delay if cues['itd'] < 0 else 0
+                right_delay = delay if cues['itd'] > 0 else 0
+                self.buffers[row, left_delay:left_delay + len(mono), 0] = cues['left_amp'] * mono
+                self.buffers[row, right_delay:right_delay + len(mono), 1] = cues['right_amp'] * mono
+                self.index[(freq, name)] = row
+                row += 1
+
+        self._sounds = {}
+
+    @classmethod
+    def from_parameters(cls, stimuli_parameters, locations):
+        """Bank for every cue and choice frequency of a soundslist"""
+        frequencies = [float(p[key]) for p in stimuli_parameters for key in ('cue_frequency', 'choice_frequency')]
+        return cls(frequencies, locations)
+
+    def buffer(self, frequency, location):
+        """Stereo buffer of a (frequency, location)"""
+        return self.buffers[self.index[(float(frequency), location)]]
+
+    def sound(self, frequency, location):
+        """sound.Sound of a (frequency, location), built on first use and then reused"""
+        key = (float(frequency), location)
+        if key not in self._sounds:
+            self._sounds[key] = sound.Sound(self.buffers[self.index[key]], sampleRate=self.samplingRate)
+        return self._sounds[key]
+
+    def prepare_sounds(self):
+        """Build every sound.Sound now rather than on first use"""
+        for freq, name in self.index:
+            self.sound(freq, name)
+
+    def play(self, frequency, location):
+        """Play a tone from the bank, like play_tone, waiting until the delayed ear has finished too"""
+        tone = self.sound(frequency, location)
+        tone.play()
+        core.wait(self.duration)
+        tone.stop()
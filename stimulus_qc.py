@@ -0,0 +1,128 @@
+"""
+Spectral QC of rendered tone sequences
+
+A rendered cue or choice sequence is a run of equal-length tones. All
+sequences of a bank are reshaped into (trial, tone, sample) and every tone
+segment of every trial goes through one batched FFT. The peak of each
+segment gives its frequency, from which the realized coherence (tones at the
+target frequency) and the tones outside frequency * 2**(+-frequency_range)
+are counted per trial.
+
+From the command line, render a bank from a soundslist and check it:
+
+    python stimulus_qc.py soundslist9010.csv --reps 40
+"""
+
+import argparse
+
+import numpy as np
+from scipy import fft
+
+QC_DTYPE = np.dtype([('expected_coherent', 'i4'), ('realized_coherent', 'i4'), ('realized_coherence', 'f8'),
+                     ('range_violations', 'i4'), ('ok', '?')])
+
+
+def segment_frequencies(sequences, samplingRate=44100, tone_duration=0.025, pad=4):
+    """Peak frequency of every tone segment
+
+    Args:
+        sequences: (n_trials, n_samples) mono or (n_trials, n_samples, 2) stereo array
+        samplingRate: Sampling rate of the sequences
+        tone_duration: Duration of each tone (s)
+        pad: Minimum zero padding factor of the FFT, for a finer frequency
+            grid. The FFT length is rounded up to a power of two
+
+    Returns:
+        (n_trials, n_tones) array of frequencies in Hz
+
+    """
+    sequences = np.asarray(sequences, dtype='float32')
+    if sequences.ndim == 3:
+        sequences = sequences[..., 0]
+    tone_len = int(samplingRate * tone_duration)
+    n_tones = sequences.shape[1] // tone_len
+    segments = sequences[:, :n_tones * tone_len].reshape(len(sequences), n_tones, tone_len)
+
+    n_fft = 1 << int(np.ceil(np.log2(pad * tone_len)))
+    # Single precision, spread over all cores
+    spectrum = np.abs(fft.rfft(segments * np.hanning(tone_len).astype('float32'), n=n_fft, axis=-1, workers=-1))
+    peak = spectrum.argmax(axis=-1)
+
+    # Parabolic interpolation around the peak bin
+    peak = np.clip(peak, 1, spectrum.shape[-1] - 2)
+    left = np.take_along_axis(spectrum, (peak - 1)[..., None], axis=-1)[..., 0]
+    mid = np.take_along_axis(spectrum, peak[..., None], axis=-1)[..., 0]
+    right = np.take_along_axis(spectrum, (peak + 1)[..., None], axis=-1)[..., 0]
+    denom = left - 2 * mid + right
+    offset = np.divide(0.5 * (left - right), denom, out=np.zeros_like(denom), where=denom != 0)
+
+    return (peak + offset) * samplingRate / n_fft
+
+
+def check_sequences(sequences, frequency, coherence, frequency_range, samplingRate=44100, tone_duration=0.025,
+                    tolerance=0.02):
+    """Realized coherence and range violations of every rendered sequence
+
+    Incoherent tones that happen to land within tolerance of the target count
+    as coherent, so realized_coherent may exceed expected_coherent; a trial
+    is ok when it has at least the expected number of target tones and no
+    tone outside the allowed range.
+
+    Args:
+        sequences: (n_trials, n_samples[, 2]) rendered sequences
+        frequency: Target frequency of each trial (scalar or per trial)
+        coherence: Coherence of each trial (scalar or per trial)
+        frequency_range: Octave range of the incoherent tones (scalar or per trial)
+        samplingRate: Sampling rate of the sequences
+        tone_duration: Duration of each tone (s)
+        tolerance: Octaves a tone may be off and still count as at the target
+
+    Returns:
+        Structured array with QC_DTYPE, one row per trial
+
+    """
+    freqs = segment_frequencies(sequences, samplingRate, tone_duration)
+    n_trials, n_tones = freqs.shape
+    frequency = np.broadcast_to(np.asarray(frequency, dtype=float), (n_trials,))[:, None]
+    coherence = np.broadcast_to(np.asarray(coherence, dtype=float), (n_trials,))
+    frequency_range = np.broadcast_to(np.asarray(frequency_range, dtype=float), (n_trials,))[:, None]
+
+    octaves = np.abs(np.log2(np.maximum(freqs, 1e-9) / frequency))
+
+    qc = np.empty(n_trials, dtype=QC_DTYPE)
+    # Same rounding as the generators: int(num_tones * coherence)
+    qc['expected_coherent'] = (n_tones * coherence).astype(int)
+    qc['realized_coherent'] = (octaves <= tolerance).sum(axis=1)
+    qc['realized_coherence'] = qc['realized_coherent'] / n_tones
+    qc['range_violations'] = (octaves > frequency_range + tolerance).sum(axis=1)
+    qc['ok'] = (qc['realized_coherent'] >= qc['expected_coherent']) & (qc['range_violations'] == 0)
+    return qc
+
+
+if __name__ == '__main__':
+    import csv
+    import time
+
+    # The generator the shells play (utils imports it from tone_synthesis)
+    from tone_synthesis import generate_tone_sequence
+
+    parser = argparse.ArgumentParser(description='Render a session bank from a soundslist and check its spectra')
+    parser.add_argument('csv_filename', nargs='?', default='soundslist.csv')
+    parser.add_argument('--reps', type=int, default=10, help='Renderings of every soundslist row')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    with open(args.csv_filename, newline='') as f:
+        rows = list(csv.DictReader(f)) * args.reps
+    freq = np.array([float(r['cue_frequency']) for r in rows])
+    coh = np.array([float(r['coherence']) for r in rows])
+    rng = np.array([float(r['cue_frequency_range']) for r in rows])
+    bank = np.stack([generate_tone_sequence(c, f, r) for c, f, r in zip(coh, freq, rng)])
+
+    start = time.perf_counter()
+    qc = check_sequences(bank, freq, coh, rng)
+    print(f"Checked {len(bank)} sequences in {time.perf_counter() - start:.3f} s: "
+          f"{qc['ok'].sum()} ok, {(~qc['ok']).sum()} failed, "
+          f"mean realized coherence {qc['realized_coherence'].mean():.3f}")
@@ -0,0 +1,136 @@
+"""
+Live telemetry from the task to a local dashboard
+
+The task publishes small JSON events (one UDP datagram each) to a local
+port. publish() only puts the event on a bounded queue and returns; a
+background thread does the sending. When the queue is full the event is
+dropped, and sending to a port nobody listens on is harmless, so a slow or
+absent dashboard can never stall the trial loop.
+
+Run the dashboard in a second terminal (or on the same machine over ssh):
+
+    python telemetry.py --port 50555
+"""
+
+import argparse
+import json
+import queue
+import socket
+import threading
+import time
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 50555
+
+
+class TelemetryPublisher:
+    """Fire-and-forget publisher of task events
+
+    Args:
+        host: Address the dashboard listens on
+        port: UDP port the dashboard listens on
+        maxsize: Number of events that may wait to be sent before new ones are dropped
+
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, maxsize=256):
+        self.address = (host, port)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.sent = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self._thread.start()
+
+    def publish(self, event, **fields):
+        """Queue one event, never blocking. Returns False if it was dropped"""
+        fields['event'] = event
+        fields['t'] = time.time()
+        try:
+            self.queue.put_nowait(fields)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            fields = self.queue.get()
+            if fields is None:
+                break
+            try:
+                self.sock.sendto(json.dumps(fields, default=float).encode(), self.address)
+                self.sent += 1
+            except OSError:
+                # No listener, full socket buffer, ... the event is lost
+                self.dropped += 1
+
+    def close(self, timeout=1.0):
+        """Stop the sending thread, giving it up to timeout seconds to drain the queue"""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self.sock.close()
+
+
+class TelemetryListener:
+    """Receiving end of the telemetry stream, used by the dashboard
+
+    Args:
+        host: Address to listen on
+        port: UDP port to listen on
+
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+
+    def recv(self, timeout=None):
+        """Next event as a dict, or None if nothing arrived within timeout seconds"""
+        self.sock.settimeout(timeout)
+        try:
+            data, _ = self.sock.recvfrom(65535)
+        except socket.timeout:
+            return None
+        return json.loads(data)
+
+    def close(self):
+        self.sock.close()
+
+
+def dashboard(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Print a running summary of the session as events come in"""
+    listener = TelemetryListener(host, port)
+    n_trials = 0
+    n_correct = 0
+    n_rewards = 0
+    print(f"Listening for task events on {host}:{port}")
+    try:
+        while True:
+            msg = listener.recv()
+            if msg['event'] == 'trial':
+                n_trials += 1
+                n_correct += bool(msg.get('correct'))
+                n_rewards += bool(msg.get('reward'))
+                print(f"[{time.strftime('%H:%M:%S', time.localtime(msg['t']))}] "
+                      f"trial {msg.get('trial')}: {msg.get('response')} "
+                      f"RT {msg.get('rt', float('nan')):.2f}s {'correct' if msg.get('correct') else 'incorrect'} | "
+                      f"{n_correct}/{n_trials} correct, {n_rewards} rewards")
+            else:
+                print(f"    {msg['event']} {', '.join(f'{k}={v}' for k, v in msg.items() if k not in ('event', 't'))}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show live events from a running task')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    dashboard(args.host, args.port)
@@ -0,0 +1,133 @@
+"""
+Tone sequences of the task, without psychopy
+
+The cue and choice sequences are synthesized here with numpy only, so the
+tools that render them outside a session (rig_orchestrator, stimulus_qc)
+do not load psychopy. utils imports these for the shells.
+"""
+
+import numpy as np
+
+
+def to_stereo(mono, left_amp=1.0, right_amp=1.0):
+    """Expand a mono signal into a stereo buffer, applying the per-channel gains.
+
+    Stimuli are stored as a single float32 mono signal and only expanded
+    here, right before being handed to sound.Sound
+
+    Args:
+        mono: 1D array holding the signal
+        left_amp: Gain of the left channel
+        right_amp: Gain of the right channel
+
+    Returns:
+        float32 array of shape (n_samples, 2)
+
+    """
+    mono = np.asarray(mono, dtype='float32')
+    stereo = np.empty((mono.shape[0], 2), dtype='float32')
+    np.multiply(mono, left_amp, out=stereo[:, 0])
+    np.multiply(mono, right_amp, out=stereo[:, 1])
+    return stereo
+
+
+def generate_tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5,seed = None):
+    """
+    Generate the stereo tone sequence the shells play.
+
+    The sequence of generate_mono_tone_sequence, at equal gain on both
+    channels.
+
+    :param coherence: Coherence level of the tone sequence.
+    :param frequency: Base frequency of the tones.
+    :param frequency_range: Range of frequency variation for incoherent tones.
+    :param sampleRate: Sampling rate of the tones.
+    :param tone_duration: Duration of each tone.
+    :param sequence_duration: Total duration of the tone sequence.
+    :param seed: Seed for random number generation.
+    :return: (n, 2) float32 numpy array containing the tone sequence.
+    """
+    # Example usage:
+    #snd = generate_tone_sequence(coherence=0.9, frequency=4000, frequency_range=1, sampleRate=44100)
+    return to_stereo(generate_mono_tone_sequence(coherence, frequency, frequency_range, sampleRate=sampleRate,
+                                                 tone_duration=tone_duration,
+                                                 sequence_duration=sequence_duration, seed=seed))
+
+
+def generate_mono_tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5, seed=None):
+    """
+    Generate a float32 mono sequence of tones with specified coherence and frequency range.
+
+    Every tone is a sine with the time base and the Hamming onset and offset
+    ramps sound.Sound(hamming=True) gives it (5 ms, or 1/15 of the tone if
+    that is shorter). All tones are computed at once into one preallocated
+    block. A given seed always gives the same sequence.
+
+    :param coherence: Coherence level of the tone sequence.
+    :param frequency: Base frequency of the tones.
+    :param frequency_range: Range of frequency variation for incoherent tones.
+    :param sampleRate: Sampling rate of the tones.
+    :param tone_duration: Duration of each tone.
+    :param sequence_duration: Total duration of the tone sequence.
+    :param seed: Seed for random number generation.
+    :return: 1D float32 numpy array containing the tone sequence.
+    """
+    num_tones = int(sequence_duration / tone_duration)
+    num_coherent_tones = int(num_tones * coherence)
+
+    if seed is not None:
+        np.random.seed(seed)  # Set the seed for reproducibility
+
+    # Coherent tones first, then the incoherent ones with octave-based spacing
+    random_octave_shift = np.random.uniform(-1, 1, size=num_tones - num_coherent_tones)
+    frequencies = np.concatenate((np.full(num_coherent_tones, float(frequency)),
+                                  frequency * 2 ** (random_octave_shift * frequency_range)))
+
+    # Shuffle the tone order
+    order = np.arange(num_tones)
+    np.random.shuffle(order)
+    frequencies = frequencies[order]
+
+    # Time base and ramps of a psychopy tone
+    tone_len = int(tone_duration * sampleRate)
+    t = np.arange(tone_len) / tone_len * tone_duration
+    window = np.ones(tone_len)
+    ramp = int(min(sampleRate // 200, tone_len // 15))
+    if tone_len > 30 and ramp > 0:
+        hamming = np.hamming(2 * ramp + 1)
+        window[:ramp] = hamming[:ramp]
+        window[-ramp:] = hamming[ramp + 1:]
+
+    # (num_tones, tone_len) block, one row per tone, flattened into the sequence
+    arr = np.empty((num_tones, tone_len), dtype='float32')
+    np.sin(2 * np.pi * frequencies[:, None] * t, out=arr, casting='same_kind')
+    arr *= window.astype('float32')
+    return arr.ravel()
+
+
+def generate_stereo_tone_sequence(coherence, frequency, frequency_range, left_amp=1.0, right_amp=0.5, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5, seed=None):
+    """
+    Generate a sequence of tones with specified coherence and frequency range.
+
+    The sequence is generated in mono (see generate_mono_tone_sequence) and
+    the channel amplitudes are only applied when expanding to stereo.
+    
+    :param coherence: Coherence level of the tone sequence.
+    :param frequency: Base frequency of the tones.
+    :param frequency_range: Range of frequency variation for incoherent tones.
+    :param left_amp: Amplitude of the tones in the left channel.
+    :param right_amp: Amplitude of the tones in the right channel.
+    :param sampleRate: Sampling rate of the tones.
+    :param tone_duration: Duration of each tone.
+    :param sequence_duration: Total duration of the tone sequence.
+    :param seed: Seed for random number generation.
+    :return: float32 numpy array containing the stereo tone sequence.
+    """
+    mono = generate_mono_tone_sequence(coherence, frequency, frequency_range, sampleRate=sampleRate,
+                                       tone_duration=tone_duration, sequence_duration=sequence_duration, seed=seed)
+
+    # Example usage
+    #cue_tone_sequence = generate_stereo_tone_sequence(coherence=0.9, frequency=4000, frequency_range=1, left_amp=1.0, right_amp=0.5)
+    #choice_tone_sequence = generate_stereo_tone_sequence(coherence=0.9, frequency=432, frequency_range=1, left_amp=0.5, right_amp=1.0)
+    
+    return to_stereo(mono, left_amp, right_amp)
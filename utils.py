@@ -11,11 +11,12 @@ June 2023
 import glob
 import json
 import os
+import time
 
 import numpy as np
 import psychopy
 import soundfile as sf
-from psychopy import visual, monitors, event, gui, core, logging, sound
+from psychopy import visual, monitors, event, core, logging, sound
 from psychopy.constants import NOT_STARTED, STARTED, FINISHED
 from psychopy.tools.monitorunittools import cm2pix
 from psychopy.tools.filetools import fromFile, toFile
@@ -23,6 +24,10 @@ from scipy.signal import resample
 from collections import OrderedDict
 import json
 
+# Tone synthesis lives in a module without psychopy; imported here for the shells
+from tone_synthesis import (to_stereo, generate_tone_sequence, generate_mono_tone_sequence,
+                            generate_stereo_tone_sequence)
+
 
 def openingDlg():
     """The opening dialogue for AV40"""
@@ -69,6 +74,7 @@ def openingDlg():
         #dist = 60
 
     # Construct dialogue common to all
+    from psychopy import gui
     dlgTitle = 'Please enter information below'
     runDlg = gui.Dlg(title=dlgTitle)
     runDlg.addField('RunID',runId)
@@ -183,38 +189,42 @@ def createAudioStream(arr, soa, samplingRate, reps, blanks=[],prepare=True):
     """
 
     Args:
-        arr: The audio stream to play
+        arr: The audio stream to play. Mono (1D) streams are kept mono until
+            the end so the repeated stream is only built once
         soa: Sound Onset Asynchrony. Time between sound onsets for each repetition
         samplingRate: Auditory samplingrate
         reps: Number of times audio stream should be repeated
         missing: which repetitions should be blank
+        prepare: Expand to a float32 stereo array ready for sound.Sound.
+            If False the float32 mono stream is returned
 
     Returns:
         Audiostream to play
 
     """
 
+    arr = np.asarray(arr, dtype='float32')
+
     # The zero padding between each click
     dur = len(arr) / samplingRate
     offset2onset_time = soa - dur
-    offset2onset_padding = np.zeros(round(samplingRate * offset2onset_time))
+    padLen = round(samplingRate * offset2onset_time)
+    period = len(arr) + padLen
 
     # The missing/absent repetitions
-    blankPeriod = np.zeros(arr.size)
     if not isinstance(blanks,list):
         blanks = [blanks]
     blankReps = np.array(blanks) - 1
 
-    # Create the whole audio stream
-    audioStream = np.array([])
+    # Create the whole audio stream in one preallocated block. Blank
+    # repetitions and padding are simply left as zeros
+    audioStream = np.zeros((period * reps,) + arr.shape[1:], dtype='float32')
     for ii in range(reps):
-        if ii in blankReps:
-            audioStream = np.concatenate((audioStream, blankPeriod, offset2onset_padding))
-        else:
-            audioStream = np.concatenate((audioStream, arr, offset2onset_padding))
-    
-    if prepare:
-        audioStream = np.vstack((audioStream,audioStream)).T.astype('float32')
+        if ii not in blankReps:
+            audioStream[ii*period : ii*period + len(arr)] = arr
+
+    if prepare and audioStream.ndim == 1:
+        audioStream = to_stereo(audioStream)
 
     return audioStream
 
@@ -257,6 +267,7 @@ def set_ttl(trigger, address):
             def close_ttl():
                 ser.close()
         except:
+            from psychopy import gui
             dlg = gui.Dlg(title="No USB TTL Found!", pos=(200, 400))
             dlg.addText('Subject Info', color='Red')
             dlg.show()
@@ -277,6 +288,7 @@ def set_ttl(trigger, address):
             def close_ttl():
                 ser.close()
         except:
+            from psychopy import gui
             dlg = gui.Dlg(title="No MMB Trigger Box Found!", pos=(200, 400))
             dlg.addText('Subject Info', color='Red')
             dlg.show()
@@ -307,35 +319,38 @@ def read_wav(filename, new_fs=48000, dual=True):
     Args:
         filename: wav filename
         new_fs: the desired sampling rate
+        dual: If the file is mono, duplicate it into two channels. This is
+            done after resampling so only one channel is ever resampled
 
-    Returns: numpy array of audio file resampled to new_fs
+    Returns: float32 numpy array of audio file resampled to new_fs
 
     """
 
     soundArray, orig_fs = sf.read(filename, dtype='float32')
-    
-    if soundArray.ndim == 1 and dual:
-        soundArray = np.vstack((soundArray, soundArray)).T
 
     if new_fs not in [orig_fs, None]:
         audTime = soundArray.shape[0] / orig_fs
         newNumSamples = round(audTime * new_fs)
-        audStream = resample(soundArray, newNumSamples)
-        return audStream
-    else:
-        return soundArray
+        soundArray = resample(soundArray, newNumSamples).astype('float32')
+
+    if soundArray.ndim == 1 and dual:
+        soundArray = to_stereo(soundArray)
+
+    return soundArray
         
 
-def createToneReps(value="A",tone_dur=0.05, blank_dur=0.05, reps=2, sampleRate=44100):
+def createToneReps(value="A",tone_dur=0.05, blank_dur=0.05, reps=2, sampleRate=44100, stereo=True):
     tmp = sound.Sound(value=value, secs=tone_dur, sampleRate=sampleRate,stereo=True, autoLog=False)
-    tone = tmp.sndArr
-    blank = np.zeros(( round(blank_dur*sampleRate), 2))
+    tone = np.asarray(tmp.sndArr, dtype='float32')
+    if tone.ndim == 2:
+        tone = tone[:, 0]
+    # Each repetition is the tone followed by a blank, built as one mono block
+    period = len(tone) + round(blank_dur*sampleRate)
+    arr = np.zeros(period * reps, dtype='float32')
     for ii in range(reps):
-        if ii == 0:
-            arr = tone
-        else:
-            arr = np.vstack((arr, tone))
-        arr = np.vstack((arr, blank))
+        arr[ii*period : ii*period + len(tone)] = tone
+    if stereo:
+        arr = to_stereo(arr)
     return arr
     
 def pauseAndReadText(win,TxtToWrite,mouse=None,txtColor = [0,0,0],keys=['escape'],wait=2):
@@ -395,102 +410,9 @@ def pauseAndReadText(win,TxtToWrite,mouse=None,txtColor = [0,0,0],keys=['escape'
             pauseText.status = FINISHED
             if useMouse:
                 mouseObj.status = FINISHED
-
-        win.flip()
+        else:
+            # The text is already on screen, no need to flip while waiting
+            time.sleep(0.02)
 
     win.flip()
     return clickedBttn
-
-def generate_tone_sequence(coherence, frequency, frequency_range, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5,seed = None):
-    # Example usage:
-    #snd = generate_tone_sequence(coherence=0.9, frequency=4000, frequency_range=1, sampleRate=44100)
-    num_tones = int(sequence_duration / tone_duration)
-    num_coherent_tones = int(num_tones * coherence)
-
-    if seed is not None:
-        np.random.seed(seed)  # Set the seed for reproducibility 
-    
-    # Generate the coherent tone sequence
-    coherent_tones_tmp = [sound.Sound(value=frequency, secs=tone_duration, sampleRate=sampleRate, stereo=True, hamming=True) for _ in range(num_coherent_tones)]
-    coherent_tones = []
-    for ii in range( len(coherent_tones_tmp) ):
-        coherent_tones.append(coherent_tones_tmp[ii].sndArr)
-
-    # Generate the incoherent tone sequence with octave-based spacing
-    incoherent_tones = []
-    for ii in range(num_tones - num_coherent_tones):
-        random_octave_shift = np.random.uniform(-1, 1)
-        random_frequency = frequency * 2 ** (random_octave_shift * frequency_range)
-        tmp = sound.Sound(value=random_frequency, secs=tone_duration, hamming=True, sampleRate=sampleRate, stereo=True)
-        #tmpSnd = tmp.sndArr
-        #incoherent_tones.append(sound.Sound(value=random_frequency, secs=tone_duration, hamming=True))
-        incoherent_tones.append(tmp.sndArr)
-
-    # Combine the coherent and incoherent tone sequences
-    tone_sequence = coherent_tones + incoherent_tones
-    np.random.shuffle(tone_sequence)
-    
-    # Now put all the tones together to make a single sound
-    for ii in range( len(tone_sequence) ):
-        if ii == 0:
-            arr = tone_sequence[0]
-        else:
-            arr = np.vstack((arr, tone_sequence[ii]))
-            
-    return arr
-    #return sound.Sound(value=arr, sampleRate=sampleRate, hamming=False)
-
-
-def generate_stereo_tone_sequence(coherence, frequency, frequency_range, left_amp=1.0, right_amp=0.5, sampleRate=44100, tone_duration=0.025, sequence_duration=0.5, seed=None):
-    """
-    Generate a sequence of tones with specified coherence and frequency range.
-    
-    :param coherence: Coherence level of the tone sequence.
-    :param frequency: Base frequency of the tones.
-    :param frequency_range: Range of frequency variation for incoherent tones.
-    :param left_amp: Amplitude of the tones in the left channel.
-    :param right_amp: Amplitude of the tones in the right channel.
-    :param sampleRate: Sampling rate of the tones.
-    :param tone_duration: Duration of each tone.
-    :param sequence_duration: Total duration of the tone sequence.
-    :param seed: Seed for random number generation.
-    :return: Numpy array containing the stereo tone sequence.
-    """
-    num_tones = int(sequence_duration / tone_duration)
-    num_coherent_tones = int(num_tones * coherence)
-
-    if seed is not None:
-        np.random.seed(seed)  # Set the seed for reproducibility
-
-    # Generate the coherent tone sequence
-    coherent_tones = []
-    for _ in range(num_coherent_tones):
-        t = np.linspace(0, tone_duration, int(sampleRate * tone_duration), endpoint=False)
-        mono_signal = np.sin(2 * np.pi * frequency * t)
-        stereo_signal = np.array([left_amp * mono_signal, right_amp * mono_signal])
-        coherent_tones.append(stereo_signal.T)
-
-    # Generate the incoherent tone sequence with octave-based spacing
-    incoherent_tones = []
-    for _ in range(num_tones - num_coherent_tones):
-        random_octave_shift = np.random.uniform(-1, 1)
-        random_frequency = frequency * 2 ** (random_octave_shift * frequency_range)
-        t = np.linspace(0, tone_duration, int(sampleRate * tone_duration), endpoint=False)
-        mono_signal = np.sin(2 * np.pi * random_frequency * t)
-        stereo_signal = np.array([left_amp * mono_signal, right_amp * mono_signal])
-        incoherent_tones.append(stereo_signal.T)
-
-    # Combine the coherent and incoherent tone sequences
-    tone_sequence = coherent_tones + incoherent_tones
-    np.random.shuffle(tone_sequence)
-
-    # Now put all the tones together to make a single sound
-    arr = np.vstack(tone_sequence)
-    
-    # Example usage
-    #cue_tone_sequence = generate_tone_sequence(coherence=0.9, frequency=4000, frequency_range=1, left_amp=1.0, right_amp=0.5)
-    #choice_tone_sequence = generate_tone_sequence(coherence=0.9, frequency=432, frequency_range=1, left_amp=0.5, right_amp=1.0)
-    
-    return arr
-
-
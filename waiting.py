@@ -0,0 +1,134 @@
+"""
+Low-CPU waiting for ITIs, timeouts and the no-response recovery loop
+
+core.wait spins for the last hogCPUperiod (0.2 s by default) of every wait,
+so the 10 ms polling loops of the shells never sleep at all and keep a core
+busy for the whole session. idle_wait sleeps for all but the last stretch of
+the wait and spins through that, which keeps its deadline accuracy. The
+stretch is one scheduler tick as measured by sleep_granularity: on Windows
+time.sleep wakes up on the system timer, 15.6 ms apart by default, so the
+module asks for a 1 ms timer (timeBeginPeriod) and still measures what it
+got. wait_for polls a condition (mouse position, key presses) at a modest
+rate, sleeping in between with a plain time.sleep, until it is met or a
+deadline passes; a poll has no deadline to meet, so it never spins. Use
+idle_wait for stimulus timing and ITIs, time.sleep or wait_for for polling.
+
+CPUMeter reports the fraction of a core the process used, to compare
+sessions with and without these waits.
+"""
+
+import atexit
+import sys
+import time
+
+from psychopy import core
+
+_granularity = None
+
+
+def _request_timer_resolution():
+    """Ask Windows for a 1 ms system timer for as long as the process runs"""
+    if sys.platform != 'win32':
+        return
+    import ctypes
+    try:
+        winmm = ctypes.windll.winmm
+        if winmm.timeBeginPeriod(1) == 0:
+            atexit.register(winmm.timeEndPeriod, 1)
+    except (AttributeError, OSError):
+        pass
+
+
+def sleep_granularity(samples=10):
+    """Longest overshoot of a 1 ms time.sleep, measured once per process (s)
+
+    This is how late a sleep can wake up, so idle_wait spins for at least
+    this long before its deadline.
+    """
+    global _granularity
+    if _granularity is None:
+        _request_timer_resolution()
+        overshoot = 0.0
+        for _ in range(samples):
+            t0 = time.perf_counter()
+            time.sleep(0.001)
+            overshoot = max(overshoot, time.perf_counter() - t0 - 0.001)
+        _granularity = overshoot
+    return _granularity
+
+
+def idle_wait(secs, hogCPUperiod=None):
+    """Like core.wait, but only spins for the last hogCPUperiod seconds
+
+    Args:
+        secs: Time to wait
+        hogCPUperiod: Final part of the wait that is spent spinning for
+            accuracy. None spins for one scheduler tick (sleep_granularity)
+            plus 1 ms, and at least 2 ms
+
+    """
+    deadline = core.getTime() + secs
+    if hogCPUperiod is None:
+        hogCPUperiod = max(0.002, sleep_granularity() + 0.001)
+    if secs > hogCPUperiod:
+        time.sleep(secs - hogCPUperiod)
+    while core.getTime() < deadline:
+        pass
+
+
+def wait_for(condition, timeout=None, poll=0.02, every=None, callback=None):
+    """Sleep until condition() returns something truthy or timeout passes
+
+    Input is polled every poll seconds, so events are picked up with at most
+    that delay while the CPU idles in between. This does not wake up on input
+    events: psychopy only updates the mouse and keyboard state when they are
+    polled (event.getKeys, mouse.getPos), and it offers nothing to block on
+    until input arrives, so polling at a low rate is the way to idle here.
+
+    Args:
+        condition: Function called every poll, e.g. checking the mouse position
+        timeout: Give up after this many seconds. None waits indefinitely
+        poll: Time between checks of condition (s)
+        every: Call callback every this many seconds while waiting
+        callback: Function called every 'every' seconds (e.g. to nudge the mouse)
+
+    Returns:
+        What condition returned, or None if the timeout passed first
+
+    """
+    start = core.getTime()
+    last_callback = start
+    while True:
+        result = condition()
+        if result:
+            return result
+
+        now = core.getTime()
+        if timeout is not None and now - start >= timeout:
+            return None
+        if every is not None and now - last_callback >= every:
+            callback()
+            last_callback = now
+
+        sleep_for = poll if timeout is None else min(poll, start + timeout - now)
+        time.sleep(max(sleep_for, 0))
+
+
+class CPUMeter:
+    """CPU time used by this process relative to wall-clock time"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def usage(self):
+        """Fraction of one core used since the meter was started or reset"""
+        wall = time.perf_counter() - self.wall_start
+        return (time.process_time() - self.cpu_start) / wall if wall > 0 else 0.0
+
+    def report(self):
+        wall = time.perf_counter() - self.wall_start
+        return f"CPU: {100 * self.usage():.1f}% of one core over {wall / 60:.1f} min"
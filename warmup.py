@@ -0,0 +1,124 @@
+"""
+Warm-up before the first trial
+
+The first sound.Sound of a session opens the audio stream, the first flips
+compile shaders and build the framebuffer, and the first call of the tone
+synthesis pays for numpy and the sound pool. Without a warm-up all of that
+lands on trial 0. warm_up does each of these a few times before the task
+starts, silently and with a blank screen, and StartupReport keeps the
+latency of the first call next to the steady state (median of the later
+calls) for each component.
+
+    startup = warm_up(win, stimuli=[greenBox, redBox],
+                      synthesis=lambda: generate_tone_sequence(0.5, 400, 0.5, seed=seed))
+    startup.save(data_file_path)
+    print(startup.summary())
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+
+class StartupReport:
+    """First-call and steady-state latency of startup components"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.latencies = {}
+
+    def measure(self, component, func, repeats=5):
+        """Call func repeats times, recording the latency of each call
+
+        Returns:
+            What the last call of func returned
+
+        """
+        times = self.latencies.setdefault(component, [])
+        result = None
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - t0)
+        return result
+
+    def rows(self):
+        """Per component: first call and steady state (ms, None after a single call) and number of calls"""
+        rows = []
+        for component, times in self.latencies.items():
+            steady = 1000 * float(np.median(times[1:])) if len(times) > 1 else None
+            rows.append({'component': component, 'first_ms': 1000 * times[0], 'steady_ms': steady,
+                         'calls': len(times)})
+        return rows
+
+    def summary(self):
+        lines = [f"Warm-up took {time.perf_counter() - self.start:.2f} s"]
+        for row in self.rows():
+            steady = f"{row['steady_ms']:8.1f} ms" if row['steady_ms'] is not None else '       -'
+            lines.append(f"  {row['component']:<20} first {row['first_ms']:8.1f} ms   steady {steady}")
+        return '\n'.join(lines)
+
+    def save(self, data_file_path):
+        """Write the report next to the data file as <name>_startup.json
+
+        A resumed session writes to the same data file, so every later launch
+        gets its own <name>_startup_2.json, _3.json ... instead of
+        overwriting the first launch's report.
+        """
+        stem = os.path.splitext(data_file_path)[0] + '_startup'
+        path = stem + '.json'
+        launch = 1
+        while os.path.exists(path):
+            launch += 1
+            path = f"{stem}_{launch}.json"
+        with open(path, 'w') as f:
+            json.dump({'warmup_s': time.perf_counter() - self.start, 'components': self.rows()}, f, indent=1)
+        return path
+
+
+def warm_up(win=None, stimuli=(), sampleRate=44100, synthesis=None, flips=10, repeats=5, report=None):
+    """Prime the audio backend, the tone synthesis and the window
+
+    Args:
+        win: The window object. None skips the renderer warm-up
+        stimuli: Visual stimuli drawn before every warm-up flip, so their
+            shaders and textures are built now. The back buffer is cleared
+            before the flip, so they are never shown
+        sampleRate: Sampling rate of the task's sounds
+        synthesis: Function rendering one typical stimulus, e.g. a call of
+            generate_tone_sequence
+        flips: Number of warm-up flips
+        repeats: Calls of each audio and synthesis step
+        report: StartupReport to add to. A new one if None
+
+    Returns:
+        The StartupReport
+
+    """
+    from psychopy import sound
+
+    report = report if report is not None else StartupReport()
+
+    # Audio: building a Sound opens the stream, playing it spins up the device
+    silence = np.zeros((int(sampleRate * 0.01), 2), dtype='float32')
+    snd = report.measure('audio Sound()', lambda: sound.Sound(silence, sampleRate=sampleRate), repeats)
+
+    def play_silence():
+        snd.play()
+        snd.stop()
+    report.measure('audio play/stop', play_silence, repeats)
+
+    if synthesis is not None:
+        report.measure('tone synthesis', synthesis, repeats)
+
+    if win is not None:
+        def draw_and_flip():
+            for stim in stimuli:
+                stim.draw()
+            win.clearBuffer()
+            win.flip()
+        report.measure('window draw/flip', draw_and_flip, flips)
+
+    return report